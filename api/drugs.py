@@ -0,0 +1,24 @@
+from flask import Flask, jsonify, request
+from data_processing.data_processing import search_drugs
+from data_processing.search import DEFAULT_LIMIT
+
+MAX_LIMIT = 500
+
+
+def register_drug_search_endpoint(server: Flask, path: str = '/api/drugs') -> None:
+    """Serve paginated drug search: ?q=<text>&how=all|brand|generic&limit=<n>&offset=<n>."""
+    def bad_request(error: str):
+        return jsonify(error=error), 400
+
+    @server.route(path)
+    def drugs():
+        limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if limit < 0 or offset < 0:
+            return bad_request("limit and offset must not be negative")
+        limit = min(limit, MAX_LIMIT)
+        try:
+            result = search_drugs(request.args.get('q'), request.args.get('how', 'all'), limit, offset)
+        except ValueError as error:
+            return bad_request(str(error))
+        return jsonify(results=result.matches, total=result.total, limit=limit, offset=offset)
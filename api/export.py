@@ -0,0 +1,124 @@
+from collections.abc import Iterator
+
+import polars as pl
+import polars.selectors as cs
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from flask import Flask, Response, jsonify, request
+from data_processing.data_processing import filter_map_data, filter_map_frames, filter_line_data
+from data_processing.filters import FilterSpec, state_abbreviation
+from config import EXPORT_BATCH_ROWS
+
+MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+    'csv': 'text/csv',
+}
+
+
+class _Chunks:
+    """Write-only file that hands back what was written since the last drain (for Arrow writers)."""
+
+    def __init__(self):
+        self.closed = False
+        self._position = 0
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def _batches(data: pl.LazyFrame) -> Iterator[pl.DataFrame]:
+    return data.collect_batches(chunk_size=EXPORT_BATCH_ROWS, lazy=True)
+
+
+def _stream_csv(data: pl.LazyFrame) -> Iterator[bytes]:
+    header = True
+    for batch in _batches(data):
+        yield batch.write_csv(include_header=header).encode()
+        header = False
+    if header:
+        yield pl.DataFrame(schema=data.collect_schema()).write_csv().encode()
+
+
+def _stream_arrow(data: pl.LazyFrame, fmt: str) -> Iterator[bytes]:
+    schema = pl.DataFrame(schema=data.collect_schema()).to_arrow().schema
+    sink = _Chunks()
+    writer = ipc.new_stream(sink, schema) if fmt == 'arrow' else pq.ParquetWriter(sink, schema)
+    with writer:
+        for batch in _batches(data):
+            writer.write_table(pa.Table.from_batches(batch.to_arrow().to_batches(), schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream(data: pl.LazyFrame, fmt: str) -> Iterator[bytes]:
+    """Yield `data` encoded as `fmt`, one batch at a time, so memory stays flat however many rows it has."""
+    # Enum-encoded columns (shared IPC copies) export as plain strings, not Arrow dictionaries
+    data = data.with_columns(cs.enum().cast(pl.String))
+    return _stream_csv(data) if fmt == 'csv' else _stream_arrow(data, fmt)
+
+
+def _export(data: pl.LazyFrame, name: str, fmt: str) -> Response:
+    return Response(stream(data, fmt), mimetype=MEDIA_TYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{name}.{fmt}"'})
+
+
+def register_export_endpoints(server: Flask, path: str = '/api/export') -> None:
+    """Serve the map and line chart aggregates as Arrow IPC stream, Parquet or CSV.
+
+    Both take ?drug=<description>&brand=Brand|Generic&utilization=Fee-for-Service|Managed Care
+    &format=arrow|parquet|csv (default parquet). <path>/map takes ?quarter=<YYYY Qn>, or
+    returns every quarter when it is omitted; <path>/line takes ?state=<abbreviation or name>.
+    """
+    def filters() -> FilterSpec:
+        return FilterSpec.from_values(request.args.get('drug'), request.args.get('brand'), request.args.get('utilization'))
+
+    def bad_request(error: str):
+        return jsonify(error=error), 400
+
+    @server.route(f'{path}/map')
+    def export_map():
+        fmt = request.args.get('format', 'parquet')
+        if fmt not in MEDIA_TYPES:
+            return bad_request(f"format must be one of {', '.join(MEDIA_TYPES)}")
+        try:
+            spec = filters()
+        except ValueError as error:
+            return bad_request(str(error))
+        quarter = request.args.get('quarter')
+        if quarter is None:
+            return _export(filter_map_frames(spec), 'map', fmt)
+        try:
+            data = filter_map_data(quarter, spec)
+        except (ValueError, IndexError):
+            return bad_request("quarter must look like '2024 Q1'")
+        return _export(data, f"map-{quarter.replace(' ', '-')}", fmt)
+
+    @server.route(f'{path}/line')
+    def export_line():
+        fmt = request.args.get('format', 'parquet')
+        if fmt not in MEDIA_TYPES:
+            return bad_request(f"format must be one of {', '.join(MEDIA_TYPES)}")
+        try:
+            spec = filters()
+        except ValueError as error:
+            return bad_request(str(error))
+        return _export(filter_line_data(state_abbreviation(request.args.get('state')), spec), 'line', fmt)
@@ -1,63 +1,264 @@
+from dataclasses import asdict
+
 import dash_mantine_components as dmc
 from config import THEME
-from dash import Dash, Input, Output, State
+from dash import Dash, Input, Output, State, ClientsideFunction, no_update
+from dash.exceptions import PreventUpdate
 from ui.layout import layout
-from data_processing.data_processing import filter_map_data, filter_line_data
-from figures.figures import create_heat_map, create_line_chart
+from views import map_view, animated_map_view, line_view, chart_views, compute_chart_views, map_base_view, restyled_map
+from data_processing.data_processing import year_quarter_list, state_list, search_drugs
+from data_processing.filters import FilterSpec, state_abbreviation
+from data_processing.reload import pin_state, served_version, start_warmup, start_watcher
 from assets.states import STATE_ABBREV
+from instrumentation.timing import timed_callback, register_request_timing
+from instrumentation.metrics import register_metrics_endpoint
+from instrumentation.health import register_health_endpoint
+from api.drugs import register_drug_search_endpoint
+from api.export import register_export_endpoints
+from background import background_manager
+from data_processing.result_cache import result_cache
+from snapshot import open_bundle
+
+bundle = open_bundle()
+if bundle is not None:
+    # Every chart is read from the static bundle: no queries, warm-up, reloads or exports.
+    # A rebuilt bundle is served (with its filter domains) once it is published
+    bundle.on_swap(pin_state)
+    map_view, animated_map_view, line_view, chart_views = (
+        bundle.map_view, bundle.animated_map_view, bundle.line_view, bundle.chart_views)
 
 app = Dash()
 
 app.title = "US Medicaid Drug Pricing Heat Map"
 
-app.layout = dmc.MantineProvider(theme=THEME, children=layout)
+app.layout = lambda: dmc.MantineProvider(theme=THEME, children=layout())
+
+register_request_timing(app.server)
+register_metrics_endpoint(app.server)
+register_health_endpoint(app.server)
+register_drug_search_endpoint(app.server)
+if bundle is None:
+    register_export_endpoints(app.server)
+    # The watcher settles which version this worker serves before it is warmed
+    start_watcher()
+    start_warmup()
+
+line_chart_manager = background_manager() if bundle is None else None
+
+def _map_outputs(animate, date_value, filters, metric_value, color_blind_mode):
+    if animate:
+        # Every quarter ships as a frame; an empty store disables the client-side restyle
+        fig, title = animated_map_view(filters, metric_value, bool(color_blind_mode))
+        return fig, title, None
+    return map_view(date_value, filters, metric_value, bool(color_blind_mode))
+
+def _line_outputs(state_value, filters, date_value, map_date=None):
+    """Line chart outputs and chart-request; with `map_date`, a missing static map is requested too."""
+    if line_chart_manager is None:
+        return (*line_view(state_value, filters, date_value), no_update)
+    with result_cache.scope():
+        line_found, view = result_cache.lookup(line_view, state_value, filters, date_value)
+        # A state change cancels any job still computing the map, so it is requested again
+        map_missing = map_date is not None and not result_cache.lookup(map_base_view, map_date, filters)[0]
+    if line_found and not map_missing:
+        return (*view, no_update)
+    # Uncached views are computed by compute_charts off the request thread
+    line_outputs = view if line_found else (no_update, no_update)
+    return (*line_outputs, [state_value, asdict(filters), date_value, map_missing, not line_found])
+
+def _background_chart_outputs(date_value, state_value, filters, metric_value, color_blind_mode):
+    with result_cache.scope():
+        map_found, map_result = result_cache.lookup(map_base_view, date_value, filters)
+        line_found, line_result = result_cache.lookup(line_view, state_value, filters, date_value)
+        if line_found:
+            map_result, _ = compute_chart_views(date_value, state_value, filters,
+                                                map_result if map_found else None, line_result)
+            return (*restyled_map(map_result, metric_value, bool(color_blind_mode)), *line_result, no_update)
+    if map_found:
+        # Only the line chart leaves the request thread
+        map_outputs = restyled_map(map_result, metric_value, bool(color_blind_mode))
+        return (*map_outputs, no_update, no_update, [state_value, asdict(filters), date_value, False, True])
+    # Neither is cached: compute_charts gets both from one scan, so the map waits for the line chart
+    return (no_update,) * 5 + ([state_value, asdict(filters), date_value, True, True],)
 
 @app.callback(
     Output('map', 'figure'),
     Output('map-title', 'children'),
+    Output('map-data', 'data'),
+    Output('line-chart', 'figure'),
+    Output('line-chart-title', 'children'),
+    Output('chart-request', 'data'),
     Input('bg-select', 'value'),
     Input('date-select', 'value'),
     Input('utilization-select', 'value'),
-    Input('metric-select', 'value'),
     Input('drug-select', 'value'),
-    Input('color-blind-switch', 'checked')
+    State('state-select', 'value'),
+    State('metric-select', 'value'),
+    State('color-blind-switch', 'checked'),
+    State('animate-switch', 'checked'),
 )
-def update_map(bg_value, date_value, utilization_value, metric_value, drug_value, color_blind_mode):
-    # Update the chart based on the selected filters
-    filtered_data = filter_map_data(
-        year_quarter=date_value,
-        drug=drug_value,
-        utilization_type=utilization_value,
-        brand_generic=bg_value
-    )
-    fig = create_heat_map(filtered_data, metric_value, color_blind_mode)
-    title = f"U.S. State Heat Map — {metric_value} vs NADAC for {date_value}"
-    return fig, title
+@timed_callback('update_charts')
+def update_charts(bg_value, date_value, utilization_value, drug_value, state_value, metric_value, color_blind_mode, animate):
+    # Filters shared by both charts update them together (memoized per filter combination)
+    state_value = state_abbreviation(state_value)
+    filters = FilterSpec.from_values(drug_value, bg_value, utilization_value)
+    if animate:
+        # The animated map reads every quarter, so each chart is queried on its own
+        map_outputs = _map_outputs(animate, date_value, filters, metric_value, color_blind_mode)
+        return (*map_outputs, *_line_outputs(state_value, filters, date_value))
+    if line_chart_manager is not None:
+        return _background_chart_outputs(date_value, state_value, filters, metric_value, color_blind_mode)
+    # Otherwise both come from one scan of the filtered rows
+    map_result, line_result = chart_views(date_value, state_value, filters, metric_value, bool(color_blind_mode))
+    return (*map_result, *line_result, no_update)
 
+@app.callback(
+    Output('map', 'figure', allow_duplicate=True),
+    Output('map-title', 'children', allow_duplicate=True),
+    Output('map-data', 'data', allow_duplicate=True),
+    Input('animate-switch', 'checked'),
+    State('bg-select', 'value'),
+    State('date-select', 'value'),
+    State('utilization-select', 'value'),
+    State('metric-select', 'value'),
+    State('drug-select', 'value'),
+    State('color-blind-switch', 'checked'),
+    prevent_initial_call=True
+)
+@timed_callback('update_map')
+def update_map(animate, bg_value, date_value, utilization_value, metric_value, drug_value, color_blind_mode):
+    filters = FilterSpec.from_values(drug_value, bg_value, utilization_value)
+    return _map_outputs(animate, date_value, filters, metric_value, color_blind_mode)
 
 @app.callback(
-    Output('line-chart', 'figure'),
-    Output('line-chart-title', 'children'),
-    Input('bg-select', 'value'),
+    Output('map', 'figure', allow_duplicate=True),
+    Output('map-title', 'children', allow_duplicate=True),
+    Input('metric-select', 'value'),
+    Input('color-blind-switch', 'checked'),
+    State('bg-select', 'value'),
+    State('utilization-select', 'value'),
+    State('drug-select', 'value'),
+    State('animate-switch', 'checked'),
+    prevent_initial_call=True
+)
+@timed_callback('update_animated_map')
+def restyle_animated_map(metric_value, color_blind_mode, bg_value, utilization_value, drug_value, animate):
+    # Frames carry one metric, so animated maps restyle on the server
+    if not animate:
+        raise PreventUpdate
+    return animated_map_view(FilterSpec.from_values(drug_value, bg_value, utilization_value), metric_value,
+                             bool(color_blind_mode))
+
+# Metric and colorscale changes restyle the map in the browser from the `map-data` store
+# (see assets/heat_map.js), so they never re-query or re-serialize the figure.
+app.clientside_callback(
+    ClientsideFunction(namespace='heat_map', function_name='restyle'),
+    Output('map', 'figure', allow_duplicate=True),
+    Output('map-title', 'children', allow_duplicate=True),
+    Input('metric-select', 'value'),
+    Input('color-blind-switch', 'checked'),
+    State('map-data', 'data'),
+    State('map', 'figure'),
+    prevent_initial_call=True
+)
+
+
+@app.callback(
+    Output('line-chart', 'figure', allow_duplicate=True),
+    Output('line-chart-title', 'children', allow_duplicate=True),
+    Output('chart-request', 'data', allow_duplicate=True),
     Input('state-select', 'value'),
-    Input('utilization-select', 'value'),
-    Input('drug-select', 'value'),
-    Input('date-select', 'value'),
+    State('bg-select', 'value'),
+    State('utilization-select', 'value'),
+    State('drug-select', 'value'),
+    State('date-select', 'value'),
+    State('animate-switch', 'checked'),
+    prevent_initial_call=True
 )
-def update_line_chart(bg_value, state_value, utilization_value, drug_value, date_value):
-    # get state abbreviation from full state name if state_value is not None
-    if state_value is not None:
-        state_value = [abbr for abbr, name in STATE_ABBREV.items() if name == state_value][0]
-
-    filtered_data = filter_line_data(
-        state=state_value,
-        drug=drug_value,
-        brand_generic=bg_value,
-        utilization_type=utilization_value
+@timed_callback('update_line_chart')
+def update_line_chart(state_value, bg_value, utilization_value, drug_value, date_value, animate):
+    filters = FilterSpec.from_values(drug_value, bg_value, utilization_value)
+    return _line_outputs(state_abbreviation(state_value), filters, date_value, None if animate else date_value)
+
+if line_chart_manager is not None:
+    @app.callback(
+        Output('map', 'figure', allow_duplicate=True),
+        Output('map-title', 'children', allow_duplicate=True),
+        Output('map-data', 'data', allow_duplicate=True),
+        Output('line-chart', 'figure', allow_duplicate=True),
+        Output('line-chart-title', 'children', allow_duplicate=True),
+        Input('chart-request', 'data'),
+        State('metric-select', 'value'),
+        State('color-blind-switch', 'checked'),
+        State('animate-switch', 'checked'),
+        background=True,
+        manager=line_chart_manager,
+        running=[(Output('line-chart-progress', 'display'), 'flex', 'none')],
+        progress=Output('line-chart-progress-status', 'children'),
+        # Any filter change supersedes the running job: its callbacks re-request what is still missing
+        cancel=[Input('bg-select', 'value'), Input('date-select', 'value'), Input('utilization-select', 'value'),
+                Input('drug-select', 'value'), Input('state-select', 'value')],
+        interval=250,
+        prevent_initial_call=True,
     )
-    fig = create_line_chart(filtered_data, selected_year_quarter=date_value)
-    title = f"NADAC vs SDUD — Unit Price and Payment per Unit (Time Series) for {STATE_ABBREV.get(state_value, state_value)}" if state_value else "NADAC vs SDUD — Unit Price and Payment per Unit (Time Series)"
-    return fig, title
+    @timed_callback('compute_charts')
+    def compute_charts(set_progress, request, metric_value, color_blind_mode, animate):
+        if request is None:
+            raise PreventUpdate
+        state_value, filters, date_value, with_map, with_line = request
+        filters = FilterSpec(**filters)
+        set_progress(f"Aggregating {filters.drug or 'all drugs'} in {STATE_ABBREV.get(state_value, state_value) or 'all states'} across every quarter…")
+        # The request already missed the cache, so compute and store without a second lookup
+        if with_map and with_line:
+            map_result, line_result = compute_chart_views(date_value, state_value, filters)
+        else:
+            map_args, line_args = (date_value, filters), (state_value, filters, date_value)
+            with result_cache.scope():
+                view, args = (map_base_view, map_args) if with_map else (line_view, line_args)
+                result = view.__wrapped__(*args)
+                result_cache.save(view, args, result)
+            map_result, line_result = (result, None) if with_map else (None, result)
+        # The animated map was drawn on the request thread since the job was requested
+        map_outputs = ((no_update,) * 3 if map_result is None or animate
+                       else restyled_map(map_result, metric_value, bool(color_blind_mode)))
+        return (*map_outputs, *(line_result or (no_update, no_update)))
+
+@app.callback(
+    Output('drug-select', 'data'),
+    Input('drug-select', 'searchValue'),
+    Input('bg-select', 'value'),
+    State('drug-select', 'value'),
+)
+def search_drug_options(search_value, bg_value, drug_value):
+    # Load matching drugs from the server index instead of shipping the whole formulary;
+    # the selected drug stays in the options so the Select keeps showing it
+    matches = search_drugs(search_value if search_value != drug_value else None, bg_value or 'all').matches
+    if drug_value is not None and drug_value not in matches:
+        matches = [drug_value] + matches
+    return matches
+
+@app.callback(
+    Output('date-select', 'data'),
+    Output('date-select', 'value'),
+    Output('state-select', 'data'),
+    Output('data-version', 'data'),
+    Input('data-version-poll', 'n_intervals'),
+    State('data-version', 'data'),
+    State('date-select', 'value'),
+    prevent_initial_call=True
+)
+def refresh_dropdowns(n_intervals, shown_version, date_value):
+    # Refresh open pages once a new data version has been swapped in; re-setting
+    # the date also redraws both charts against the new data
+    if bundle is not None:
+        # Views load a newly published bundle only when read; the poll must not wait for one
+        bundle.refresh()
+    version = served_version()
+    if version == shown_version:
+        raise PreventUpdate
+    quarters = year_quarter_list()
+    date_value = date_value if date_value in quarters else quarters[-1]
+    return quarters, date_value, state_list(), version
 
 # Help modal callbacks
 @app.callback(
@@ -0,0 +1,39 @@
+// Client-side heat map restyling: swaps the colored metric and colorscale using the
+// per-state data the server stored in `map-data`, without another round-trip.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    heat_map: {
+        restyle: function(metric, colorFriendly, store, figure) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!metric || !store || !figure || !figure.data || !figure.data.length) {
+                return [noUpdate, noUpdate];
+            }
+
+            const style = store.metrics[metric.replace(/ /g, '_').toLowerCase()];
+            if (!style) {
+                return [noUpdate, noUpdate];
+            }
+
+            const coloraxis = Object.assign({}, figure.layout.coloraxis, {
+                colorscale: colorFriendly ? style.colorscales.friendly : style.colorscales.default,
+                cmid: style.cmid,
+            });
+            coloraxis.colorbar = Object.assign({}, coloraxis.colorbar, {
+                title: Object.assign({}, (coloraxis.colorbar || {}).title, {text: style.colorbar_title}),
+                tickformat: style.tickformat,
+            });
+
+            const trace = Object.assign({}, figure.data[0], {
+                z: style.z,
+                hovertemplate: style.hovertemplate,
+            });
+
+            return [
+                Object.assign({}, figure, {
+                    data: [trace].concat(figure.data.slice(1)),
+                    layout: Object.assign({}, figure.layout, {coloraxis: coloraxis}),
+                }),
+                style.title,
+            ];
+        }
+    }
+});
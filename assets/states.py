@@ -54,4 +54,7 @@ STATE_ABBREV = {
     "WI": "Wisconsin",
     "WY": "Wyoming",
     "DC": "District of Columbia",
-}
\ No newline at end of file
+}
+
+# Reverse lookup: full state name to abbreviation
+STATE_BY_NAME = {name: abbr for abbr, name in STATE_ABBREV.items()}
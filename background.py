@@ -0,0 +1,68 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dash.background_callback.managers.diskcache_manager import DiskcacheManager
+from config import BACKGROUND_CALLBACKS, BACKGROUND_DIR, BACKGROUND_WORKERS
+
+try:
+    import diskcache
+    # Not used here (jobs run on threads), but DiskcacheManager.__init__ requires them
+    import multiprocess  # noqa: F401
+    import psutil  # noqa: F401
+except ImportError:  # optional (dash[diskcache]): without it heavy callbacks run inline
+    diskcache = None
+
+# A job whose worker died stops reporting as running after this long
+JOB_TIMEOUT = 600
+
+
+class LocalQueueManager(DiskcacheManager):
+    """Background callback manager that runs jobs on a thread pool in the serving process.
+
+    Dash's DiskcacheManager forks a process per job, and a forked child deadlocks in
+    Polars once the parent has run a query. Threads keep the request thread free
+    (Polars releases the GIL while it works) and share the process's result cache,
+    while diskcache carries results, progress and job state between workers.
+
+    Cancelling a job drops it if it is still queued; a running query finishes, but
+    the browser has stopped polling for it.
+    """
+
+    def __init__(self, cache: 'diskcache.Cache', workers: int = BACKGROUND_WORKERS):
+        super().__init__(cache)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='nadac-background')
+
+    @staticmethod
+    def _job_key(job: str) -> str:
+        return f"job-{job}"
+
+    def call_job_fn(self, key, job_fn, args, context) -> str:
+        job = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.handle.set(self._job_key(job), key, expire=JOB_TIMEOUT)
+        self._executor.submit(self._run, job, key, job_fn, args, context)
+        return job
+
+    def _run(self, job: str, key, job_fn, args, context) -> None:
+        if not self.job_running(job):
+            return  # cancelled while queued
+        # The job stays "running" until its result is collected (get_result terminates it),
+        # so a poll never sees a finished job with no result and takes it as cancelled
+        job_fn(key, self._make_progress_key(key), args, context)
+
+    def job_running(self, job) -> bool:
+        return job is not None and self._job_key(job) in self.handle
+
+    def terminate_job(self, job) -> None:
+        if job is not None:
+            self.handle.delete(self._job_key(job))
+
+    def terminate_unhealthy_job(self, job) -> bool:
+        return False
+
+
+def background_manager() -> LocalQueueManager | None:
+    """Return the manager for heavy callbacks, or None to run them inline."""
+    if not BACKGROUND_CALLBACKS or diskcache is None:
+        return None
+    return LocalQueueManager(diskcache.Cache(str(BACKGROUND_DIR)))
@@ -0,0 +1,111 @@
+"""Microbenchmark: metric and percentile expressions on state-level data across all quarters.
+
+Percentiles are ranked within each quarter, as for the animated map. To measure
+a change to data_processing/expressions.py, time the baseline commit's
+expressions from a worktree with --tree, then compare:
+
+    git worktree add /tmp/expressions-baseline <baseline commit>
+    python -m benchmarks.bench_expressions --tree /tmp/expressions-baseline --label expressions-baseline
+    python -m benchmarks.bench_expressions --compare benchmarks/results/expressions-baseline.json
+
+Trees without the layered helpers (with_per_unit_metrics, with_percentiles) are
+timed with their public expressions, each percentile windowed over the quarter.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from benchmarks.run import RESULTS_DIR, compare, git_commit, use_tree
+
+PARTITION = ['year', 'quarter']
+COLUMNS = ['payment_per_unit', 'markup_per_unit', 'markup_percentile', 'payment_per_unit_percentile']
+
+
+def totals_frame(quarters: int, groups: int, seed: int = 0) -> pl.DataFrame:
+    """Return a map_totals-shaped frame with `groups` rows per quarter (states x filter combinations)."""
+    rng = np.random.default_rng(seed)
+    n = quarters * groups
+    units = rng.uniform(1e3, 1e7, n)
+    return pl.DataFrame({
+        'year': np.repeat(2015 + np.arange(quarters) // 4, groups),
+        'quarter': np.repeat(np.arange(quarters) % 4 + 1, groups),
+        'state': rng.integers(0, 51, n).astype(str),
+        'units': units,
+        'total_amt': units * rng.uniform(1, 10, n),
+        'weighted_nadac_total': units * rng.uniform(1, 8, n),
+    })
+
+
+def metrics():
+    """Return a function adding the per-unit metrics and quarterly percentiles, from the tree under test."""
+    from data_processing import expressions
+
+    if hasattr(expressions, 'with_percentiles'):
+        return lambda data: (data.pipe(expressions.with_per_unit_metrics)
+                             .pipe(expressions.with_percentiles, partition_by=PARTITION))
+    return lambda data: data.with_columns(
+        expressions.payment_per_unit(),
+        expressions.markup_per_unit(),
+        expressions.markup_percentile().over(PARTITION),
+        expressions.payment_per_unit_percentile().over(PARTITION),
+    )
+
+
+def _time(func, repeat: int) -> dict:
+    """Return median timings for `func()`, in seconds, after one warm-up call."""
+    func()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'runs': repeat}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', default=datetime.now().strftime('expressions-%Y%m%d-%H%M%S'))
+    parser.add_argument('--quarters', type=int, default=40)
+    parser.add_argument('--groups', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--compare', type=Path, help="Previous results JSON to diff against")
+    parser.add_argument('--tree', type=Path, help="Time the expressions of another checkout (default: this one)")
+    args = parser.parse_args()
+
+    use_tree(args.tree)
+    add_metrics = metrics()
+    data = totals_frame(args.quarters, args.groups).lazy()
+    cases = {
+        'cse_off': lambda: add_metrics(data).select(COLUMNS).collect(
+            optimizations=pl.QueryOptFlags(comm_subexpr_elim=False)),
+        'cse_on': lambda: add_metrics(data).select(COLUMNS).collect(),
+    }
+
+    print(f"{args.quarters} quarters x {args.groups} rows, median of {args.repeat}:")
+    results = {}
+    for name, func in cases.items():
+        result = results[name] = _time(func, args.repeat)
+        print(f"  {name:<10} {result['median_s'] * 1e3:8.2f} ms")
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{args.label}.json"
+    output.write_text(json.dumps({
+        'label': args.label,
+        'git_commit': git_commit(args.tree),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }, indent=2))
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(json.loads(output.read_text()), json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
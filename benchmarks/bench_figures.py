@@ -0,0 +1,122 @@
+"""Microbenchmark: heat map and line chart figure build + JSON serialization.
+
+Run from the repo root. To measure a change to figures/figures.py, time the
+baseline commit's builders from a worktree with --tree, then compare:
+
+    git worktree add /tmp/figures-baseline <baseline commit>
+    python -m benchmarks.bench_figures --tree /tmp/figures-baseline --label figures-baseline
+    python -m benchmarks.bench_figures --compare benchmarks/results/figures-baseline.json
+
+The builders get LazyFrames, which the baseline (which collects its input) and
+the current builders both accept.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import plotly.io as pio
+import polars as pl
+
+from assets.states import STATE_ABBREV
+from benchmarks.run import RESULTS_DIR, compare, git_commit, use_tree
+
+
+def state_frame(seed: int = 0) -> pl.DataFrame:
+    """Return a filter_map_data-shaped frame with one row per state."""
+    rng = np.random.default_rng(seed)
+    n = len(STATE_ABBREV)
+    units = rng.uniform(1e5, 1e7, n)
+    total = units * rng.uniform(1, 10, n)
+    nadac = units * rng.uniform(1, 8, n)
+    return pl.DataFrame({
+        'state': list(STATE_ABBREV),
+        'rx_ct': rng.integers(1_000, 100_000, n),
+        'units': units,
+        'total_amt': total,
+        'weighted_nadac_total': nadac,
+        'payment_per_unit': total / units,
+        'markup_per_unit': (total - nadac) / units,
+        'markup_percentile': rng.uniform(0.01, 1, n),
+        'payment_per_unit_percentile': rng.uniform(0.01, 1, n),
+    })
+
+
+def date_frame(quarters: int = 40, seed: int = 0) -> pl.DataFrame:
+    """Return a filter_line_data-shaped frame with one row per quarter."""
+    rng = np.random.default_rng(seed)
+    units = rng.uniform(1e7, 1e8, quarters)
+    total = units * rng.uniform(1, 10, quarters)
+    nadac = units * rng.uniform(1, 8, quarters)
+    return pl.DataFrame({
+        'date': [datetime(2015 + i // 4, (i % 4) * 3 + 1, 1) for i in range(quarters)],
+        'rx_ct': rng.integers(1_000, 100_000, quarters),
+        'units': units,
+        'total_amt': total,
+        'weighted_nadac_total': nadac,
+        'payment_per_unit': total / units,
+        'weighted_nadac_per_unit': nadac / units,
+        'markup_per_unit': (total - nadac) / units,
+    })
+
+
+def _time(func, repeat: int) -> dict:
+    """Return median build and to_json timings for `func()`, in seconds."""
+    build, serialize = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fig = func()
+        built = time.perf_counter()
+        pio.to_json(fig, validate=False)
+        build.append(built - start)
+        serialize.append(time.perf_counter() - built)
+    return {
+        'build_s': statistics.median(build),
+        'json_s': statistics.median(serialize),
+        'median_s': statistics.median(b + s for b, s in zip(build, serialize)),
+        'runs': repeat,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--label', default=datetime.now().strftime('figures-%Y%m%d-%H%M%S'))
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--compare', type=Path, help="Previous results JSON to diff against")
+    parser.add_argument('--tree', type=Path, help="Time the figure builders of another checkout (default: this one)")
+    args = parser.parse_args()
+
+    use_tree(args.tree)
+    from figures.figures import create_heat_map, create_line_chart
+
+    states, dates = state_frame().lazy(), date_frame().lazy()
+    cases = {
+        'heat_map': lambda: create_heat_map(states, 'Markup Per Unit'),
+        'line_chart': lambda: create_line_chart(dates, '2020 Q1'),
+    }
+
+    print(f"{'figure':<12}{'build ms':>10}{'json ms':>10}{'total ms':>10}")
+    results = {}
+    for name, func in cases.items():
+        result = results[name] = _time(func, args.repeat)
+        print(f"{name:<12}{result['build_s'] * 1e3:>10.2f}{result['json_s'] * 1e3:>10.2f}{result['median_s'] * 1e3:>10.2f}")
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{args.label}.json"
+    output.write_text(json.dumps({
+        'label': args.label,
+        'git_commit': git_commit(args.tree),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }, indent=2))
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(json.loads(output.read_text()), json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Generate synthetic, schema-compatible NADAC/SDUD data for benchmarks.
+
+Run from the repo root:
+
+    python -m benchmarks.generate_data --rows 1_000_000 --output data/heat_map.parquet
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from assets.states import STATE_ABBREV
+
+STEMS = ['ATORVASTATIN', 'LISINOPRIL', 'METFORMIN', 'AMLODIPINE', 'OMEPRAZOLE', 'SERTRALINE',
+         'GABAPENTIN', 'LEVOTHYROXINE', 'ALBUTEROL', 'INSULIN GLARGINE', 'APIXABAN', 'ADALIMUMAB',
+         'SEMAGLUTIDE', 'BUPRENORPHINE', 'ARIPIPRAZOLE', 'FLUTICASONE', 'MONTELUKAST', 'ESCITALOPRAM']
+FORMS = ['TAB', 'CAP', 'TAB ER', 'SOLN', 'SUSP', 'INHALER', 'PEN INJ']
+STRENGTHS = ['1 MG', '2.5 MG', '5 MG', '10 MG', '20 MG', '25 MG', '40 MG', '50 MG', '100 MG', '500 MG']
+
+
+def drug_catalog(n_drugs: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (descriptions, is_brand, unit price) for `n_drugs` distinct drugs."""
+    descriptions = []
+    seen = set()
+    while len(descriptions) < n_drugs:
+        name = f"{rng.choice(STEMS)} {rng.choice(STRENGTHS)} {rng.choice(FORMS)}"
+        if name in seen:
+            name = f"{name} {len(descriptions)}"
+        seen.add(name)
+        descriptions.append(name)
+    is_brand = rng.random(n_drugs) < 0.25
+    # Brands cost one to two orders of magnitude more per unit than generics
+    unit_price = np.where(is_brand, rng.lognormal(3.0, 1.0, n_drugs), rng.lognormal(-1.0, 1.0, n_drugs))
+    return np.array(descriptions), is_brand, unit_price
+
+
+def generate_chunk(rows: int, quarters: list[tuple[int, int]], catalog: tuple, state_weights: np.ndarray,
+                   drug_weights: np.ndarray, rng: np.random.Generator) -> pa.Table:
+    """Return `rows` synthetic utilization rows with the columns data_processing.py uses."""
+    descriptions, is_brand, unit_price = catalog
+    states = np.array(list(STATE_ABBREV))
+
+    quarter_idx = rng.integers(0, len(quarters), rows)
+    years = np.array([y for y, _ in quarters], dtype=np.int32)[quarter_idx]
+    qtrs = np.array([q for _, q in quarters], dtype=np.int32)[quarter_idx]
+    drug_idx = rng.choice(len(descriptions), rows, p=drug_weights)
+    state_idx = rng.choice(len(states), rows, p=state_weights)
+
+    units = np.round(rng.lognormal(5.0, 1.5, rows), 3)
+    rx_ct = np.maximum(1, (units / rng.uniform(10, 90, rows)).astype(np.int64))
+    nadac_per_unit = unit_price[drug_idx] * rng.uniform(0.9, 1.1, rows)
+    # Medicaid pays NADAC plus a state-and-drug dependent markup
+    total_amt = np.round(units * nadac_per_unit * rng.lognormal(0.15, 0.25, rows), 2)
+    weighted_nadac = np.round(units * nadac_per_unit, 4)
+    nadac_missing = rng.random(rows) < 0.08
+
+    return pa.table({
+        'year': years,
+        'quarter': qtrs,
+        'state': pa.array(states[state_idx]),
+        'description': pa.array(descriptions[drug_idx]),
+        'is_brand': is_brand[drug_idx],
+        'is_ffsu': rng.random(rows) < 0.3,
+        'rx_ct': rx_ct,
+        'units': units,
+        'total_amt': total_amt,
+        'weighted_nadac_total': pa.array(weighted_nadac, mask=nadac_missing),
+    })
+
+
+def generate(output: Path, rows: int, n_drugs: int = 5_000, first_year: int = 2017, n_quarters: int = 32,
+             chunk_rows: int = 2_000_000, seed: int = 0) -> None:
+    """Write `rows` synthetic rows to `output` in bounded-memory chunks."""
+    rng = np.random.default_rng(seed)
+    quarters = [(first_year + i // 4, i % 4 + 1) for i in range(n_quarters)]
+    catalog = drug_catalog(n_drugs, rng)
+    # Utilization is heavily skewed: a few drugs and large states dominate
+    drug_weights = 1 / np.arange(1, n_drugs + 1) ** 1.1
+    drug_weights /= drug_weights.sum()
+    state_weights = rng.lognormal(0, 1, len(STATE_ABBREV))
+    state_weights /= state_weights.sum()
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    writer = None
+    try:
+        for start in range(0, rows, chunk_rows):
+            table = generate_chunk(min(chunk_rows, rows - start), quarters, catalog, state_weights, drug_weights, rng)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema, compression='zstd')
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=lambda v: int(v.replace('_', '')), default=1_000_000)
+    parser.add_argument('--output', type=Path, default=Path('data/heat_map.parquet'))
+    parser.add_argument('--drugs', type=int, default=5_000)
+    parser.add_argument('--first-year', type=int, default=2017)
+    parser.add_argument('--quarters', type=int, default=32)
+    parser.add_argument('--chunk-rows', type=int, default=2_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.rows, args.drugs, args.first_year, args.quarters, args.chunk_rows, args.seed)
+    print(f"Wrote {args.rows:,} rows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
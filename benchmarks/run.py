@@ -0,0 +1,165 @@
+"""End-to-end benchmark suite for the data layer and figure builders.
+
+Run from the repo root against real or synthetic data (see benchmarks/generate_data.py):
+
+    python -m benchmarks.run --data data/heat_map.parquet --label my-change
+    python -m benchmarks.run --data data/heat_map.parquet --compare benchmarks/results/baseline.json
+    python -m benchmarks.run --data data/heat_map.parquet --engines polars
+
+Every case runs once per query engine (polars, and duckdb when installed); results
+are keyed "<engine>/<case>" and written as JSON to benchmarks/results/<label>.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def git_commit(tree: Path | None = None) -> str | None:
+    """Return the short commit checked out in `tree` (default: this repo)."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=tree or Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def use_tree(tree: Path | None) -> None:
+    """Import the code under test from another checkout, e.g. a worktree of the baseline commit.
+
+    Call before importing any module being measured; the benchmark itself keeps
+    running from this tree, so older commits need no copy of it.
+    """
+    if tree is not None:
+        sys.path.insert(0, str(tree.resolve()))
+
+
+def _time(func: Callable, repeat: int) -> dict:
+    """Return first-call and steady-state timings for `func`, in seconds."""
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {
+        'first_s': first,
+        'median_s': statistics.median(runs),
+        'min_s': min(runs),
+        'max_s': max(runs),
+        'runs': repeat,
+    }
+
+
+def available_engines() -> list[str]:
+    from data_processing.engine import ENGINES, duckdb
+    return [name for name in ENGINES if name != 'duckdb' or duckdb is not None]
+
+
+def benchmark_cases() -> dict[str, Callable]:
+    """Return the named cases for the selected engine; imports happen after NADAC_BASE_DATA is set."""
+    from data_processing.data_processing import year_quarter_list, drug_list, filter_map_data, filter_map_frames, filter_line_data, filter_chart_data, top_drugs
+    from data_processing.engine import current_files, get_engine
+    from data_processing.filters import FilterSpec
+    from figures.figures import create_heat_map, create_animated_heat_map, create_line_chart
+
+    latest = year_quarter_list()[-1]
+    # The highest-spend drug gives the heaviest single-drug query
+    top_drug = top_drugs(1)[0]
+    map_frame = filter_map_data(latest, FilterSpec()).collect(engine='streaming')
+    line_frame = filter_line_data(None, FilterSpec()).collect(engine='streaming')
+
+    return {
+        'scan_metadata': lambda: get_engine().scan_metadata(current_files()),
+        'year_quarter_list': year_quarter_list,
+        'drug_list': drug_list,
+        'filter_map_data': lambda: filter_map_data(latest, FilterSpec()).collect(engine='streaming'),
+        'filter_map_data_drug': lambda: filter_map_data(latest, FilterSpec(drug=top_drug, is_ffsu=True)).collect(engine='streaming'),
+        'filter_map_frames': lambda: filter_map_frames(FilterSpec()).collect(engine='streaming'),
+        'filter_line_data': lambda: filter_line_data(None, FilterSpec()).collect(engine='streaming'),
+        'filter_line_data_state_drug': lambda: filter_line_data('OH', FilterSpec(drug=top_drug)).collect(engine='streaming'),
+        # Both charts for one interaction: compare with filter_map_data + filter_line_data
+        'filter_chart_data': lambda: filter_chart_data(latest, None, FilterSpec()),
+        'filter_chart_data_drug': lambda: filter_chart_data(latest, None, FilterSpec(drug=top_drug)),
+        'create_heat_map': lambda: create_heat_map(map_frame, 'Payment Per Unit'),
+        'create_line_chart': lambda: create_line_chart(line_frame, latest),
+        'end_to_end_map': lambda: create_heat_map(filter_map_data(latest, FilterSpec()), 'Payment Per Unit'),
+        'end_to_end_animated_map': lambda: create_animated_heat_map(filter_map_frames(FilterSpec()), 'Payment Per Unit'),
+        'end_to_end_line': lambda: create_line_chart(filter_line_data(None, FilterSpec()), latest),
+    }
+
+
+def run(data: Path, label: str, repeat: int, engines: list[str] | None = None) -> dict:
+    os.environ['NADAC_BASE_DATA'] = str(data)
+    import polars as pl
+    from data_processing.cube import cube_is_current
+    from data_processing.engine import current_files, get_engine, select_engine
+    from data_processing.source import data_version, scan_source
+
+    rows = scan_source(data).select(pl.len()).collect().item()
+    engines = engines or available_engines()
+    results = {}
+    for engine in engines:
+        select_engine(engine)
+        # Load the engine's per-version state (e.g. the DuckDB database) outside the timings
+        get_engine().scan_metadata(current_files())
+        for case, func in benchmark_cases().items():
+            name = f"{engine}/{case}"
+            results[name] = _time(func, repeat)
+            print(f"{name:<38}{results[name]['median_s'] * 1e3:>12.2f} ms (first {results[name]['first_s'] * 1e3:.2f} ms)")
+
+    return {
+        'label': label,
+        'git_commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'engines': engines,
+        'data': {'path': str(data), 'rows': rows, 'version': data_version(data), 'cube': cube_is_current(source=data)},
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Print median deltas against a previous results file."""
+    print(f"\nvs {baseline['label']} ({baseline.get('git_commit')})")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = (result['median_s'] - before['median_s']) / before['median_s'] * 100 if before['median_s'] else 0.0
+        print(f"{name:<38}{before['median_s'] * 1e3:>10.2f} -> {result['median_s'] * 1e3:>10.2f} ms ({change:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', type=Path, default=Path('data/heat_map.parquet'))
+    parser.add_argument('--label', default=datetime.now().strftime('%Y%m%d-%H%M%S'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--compare', type=Path, help="Previous results JSON to diff against")
+    parser.add_argument('--engines', type=lambda v: v.split(','), help="Comma-separated query engines (default: all installed)")
+    args = parser.parse_args()
+
+    results = run(args.data, args.label, args.repeat, args.engines)
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{args.label}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from typing import Any
 
@@ -15,11 +16,65 @@ TEXT_SECONDARY = '#4a5568'
 TEXT_MUTED = '#718096'           
 BORDER_COLOR = '#e2e8f0'
 
-BASE_DATA = Path("data/heat_map.parquet")
+# A single parquet file, or a hive-partitioned directory (year=YYYY/quarter=Q/*.parquet)
+BASE_DATA = Path(os.environ.get("NADAC_BASE_DATA", "data/heat_map.parquet"))
+# Precomputed aggregate cube built by `python -m data_processing.cube`
+CUBE_DATA = Path("data/heat_map_cube.parquet")
+# Dropdown metadata sidecar, keyed on BASE_DATA mtime and size
+METADATA_CACHE = Path("data/heat_map_meta.json")
+
+# Map/line view result cache: entries kept per process, plus an optional
+# directory shared by every worker on the host
+RESULT_CACHE_SIZE = int(os.environ.get("NADAC_RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_DIR = os.environ.get("NADAC_RESULT_CACHE_DIR")
+
+# Per-callback stage timers (query / figure / encode) always feed /metrics; this also logs them as JSON lines
+TIMING_ENABLED = os.environ.get("NADAC_TIMING", "").lower() in ("1", "true", "yes", "on")
+
+# Query engine for map/line/list queries: "polars" (default) or "duckdb", which
+# loads each data version into a read-only database under DUCKDB_DIR (requires duckdb)
+QUERY_ENGINE = os.environ.get("NADAC_QUERY_ENGINE", "polars")
+DUCKDB_DIR = Path(os.environ.get("NADAC_DUCKDB_DIR", "data/duckdb"))
+
+# Serve base data and cube from memory-mapped Arrow IPC snapshots shared by all
+# workers (e.g. /dev/shm/nadac); unset to scan parquet per worker. Only these
+# snapshots Enum-encode state and description; parquet scans keep them as strings
+SHARED_IPC_DIR = os.environ.get("NADAC_SHARED_IPC_DIR")
+
+# Seconds between checks for new base data; a new version is prepared in the
+# background and swapped in atomically (0 disables the watcher)
+RELOAD_INTERVAL = float(os.environ.get("NADAC_RELOAD_INTERVAL", "30"))
+# Each served data version is staged here (hard links to its base data and cube), and
+# the version every worker serves is published here; share it between workers
+VERSIONS_DIR = Path(os.environ.get("NADAC_VERSIONS_DIR", "data/versions"))
+
+# Views precomputed before /health reports ready (and before each reload is
+# swapped in): the default view plus the top-N drugs by total spend
+WARMUP_TOP_DRUGS = int(os.environ.get("NADAC_WARMUP_TOP_DRUGS", "10"))
+WARMUP_WORKERS = int(os.environ.get("NADAC_WARMUP_WORKERS", "4"))
+
+# Heavy callbacks (uncached line charts, with the map when it shares their scan) run as
+# Dash background callbacks on a local job queue of BACKGROUND_WORKERS threads when
+# dash[diskcache] is installed; results and progress pass through BACKGROUND_DIR so any
+# worker can answer the browser's polls. 0 disables it and runs them inline.
+BACKGROUND_CALLBACKS = os.environ.get("NADAC_BACKGROUND_CALLBACKS", "1").lower() in ("1", "true", "yes", "on")
+BACKGROUND_DIR = Path(os.environ.get("NADAC_BACKGROUND_DIR", "data/background"))
+BACKGROUND_WORKERS = int(os.environ.get("NADAC_BACKGROUND_WORKERS", "2"))
+
+# Serve every chart from the static bundle `python -m snapshot --output <dir>` last
+# published under this directory instead of querying the base data (which need not
+# be present); views outside the bundle show as unavailable, and the export API,
+# warm-up and reload watcher are off
+STATIC_BUNDLE = os.environ.get("NADAC_STATIC_BUNDLE")
+
+# Rows per batch streamed by the /api/export endpoints (one Parquet row group each)
+EXPORT_BATCH_ROWS = int(os.environ.get("NADAC_EXPORT_BATCH_ROWS", "65536"))
 
 HEADER_TITLE = "NADAC Heat Map Dashboard"
 METRICS = ['payment_per_unit','markup_per_unit','markup_percentile','payment_per_unit_percentile']
-METRIC_DROPDOWN_LABELS = [x.replace('_', ' ').title() for x in METRICS]
+# Per-state change vs the previous quarter, computed in the same map query
+CHANGE_METRICS = ['payment_per_unit_change','markup_per_unit_change']
+METRIC_DROPDOWN_LABELS = [x.replace('_', ' ').title() for x in METRICS + CHANGE_METRICS]
 
 THEME: Any = {
     # Custom brand scale (light -> dark) anchored on our PRIMARY_COLOR (#1a365d)
@@ -0,0 +1,181 @@
+import argparse
+import functools
+import json
+import os
+from itertools import combinations
+from pathlib import Path
+
+import polars as pl
+from polars import col as c
+import polars.selectors as cs
+from data_processing.metadata import encode_categoricals
+from data_processing.source import DataFiles, data_version, link_or_copy, scan_source
+from data_processing.shared import scan_shared, shared_enabled
+from config import BASE_DATA, CUBE_DATA
+
+# Dimensions kept at full detail in every cube row.
+CUBE_KEYS = ['year', 'quarter', 'state', 'has_nadac']
+# Dimensions that are also materialized as "all" rollups.
+ROLLUP_KEYS = ['description', 'is_brand', 'is_ffsu']
+ROLLUP_DTYPES = {'description': pl.String, 'is_brand': pl.Boolean, 'is_ffsu': pl.Boolean}
+# Parquet key-value metadata entry holding the data_version() the cube was built from
+VERSION_KEY = 'nadac.data_version'
+
+
+def measures() -> pl.Expr:
+    """Return the summable measure columns (rx, units, total_amt, weighted_nadac_total)."""
+    return cs.matches('(?i)rx|total|units')
+
+
+def rollup_mask(description: bool, is_brand: bool, is_ffsu: bool) -> int:
+    """Return the rollup bitmask for the given set of rolled-up dimensions.
+
+    Bit 0 = all drugs, bit 1 = all brand/generic, bit 2 = all utilization.
+    """
+    return int(description) | int(is_brand) << 1 | int(is_ffsu) << 2
+
+
+def build_cube(data: pl.LazyFrame) -> pl.LazyFrame:
+    """Aggregate the raw rows into a cube with every description/is_brand/is_ffsu rollup.
+
+    Rolled-up dimensions are null and flagged in the `rollup` bitmask column.
+    `has_nadac` keeps rows without a weighted NADAC separable for the line chart,
+    and `source_rows` counts the raw rows summed into each cube row.
+    """
+    leaves = (
+        data
+        .with_columns(c.weighted_nadac_total.is_not_null().alias('has_nadac'))
+        .group_by(CUBE_KEYS + ROLLUP_KEYS)
+        .agg(measures().sum(), pl.len().cast(pl.UInt32).alias('source_rows'))
+    )
+    columns = CUBE_KEYS + ROLLUP_KEYS
+
+    grouping_sets = []
+    for n in range(len(ROLLUP_KEYS) + 1):
+        for rolled in combinations(ROLLUP_KEYS, n):
+            keys = CUBE_KEYS + [k for k in ROLLUP_KEYS if k not in rolled]
+            mask = rollup_mask(*(k in rolled for k in ROLLUP_KEYS))
+            grouping_sets.append(
+                leaves
+                .group_by(keys)
+                .agg(measures().sum(), c.source_rows.sum())
+                .with_columns(
+                    *(pl.lit(None, dtype=ROLLUP_DTYPES[k]).alias(k) for k in rolled),
+                    pl.lit(mask, dtype=pl.UInt8).alias('rollup'),
+                )
+                .select(columns + ['rollup', measures(), 'source_rows'])
+            )
+
+    return pl.concat(grouping_sets, how='vertical_relaxed')
+
+
+@functools.lru_cache(maxsize=8)
+def _read_cube_version(cube_path: Path, mtime_ns: int, size: int) -> dict | None:
+    # Keyed on the file's stat so each footer is read once, not on every query
+    value = pl.read_parquet_metadata(cube_path).get(VERSION_KEY)
+    return json.loads(value) if value else None
+
+
+def cube_version(cube_path: Path = CUBE_DATA) -> dict | None:
+    """Return the data_version() of the source the cube was built from, or None if unknown."""
+    try:
+        stat = cube_path.stat()
+    except FileNotFoundError:
+        return None
+    return _read_cube_version(cube_path, stat.st_mtime_ns, stat.st_size)
+
+
+def cube_is_current(cube_path: Path = CUBE_DATA, source: Path = BASE_DATA) -> bool:
+    """Return True when the cube was built from the current version of the source data."""
+    version = cube_version(cube_path)
+    return version is not None and version == data_version(source)
+
+
+def stage_cube(source: Path, version: dict, cube_path: Path = CUBE_DATA) -> Path | None:
+    """Hard-link the cube next to a staged `source` if it was built from that `version`.
+
+    Returns the staged cube, or None when the cube is missing or built from other
+    data, so that version is answered from the base data instead.
+    """
+    staged = source.parent / cube_path.name
+    if not staged.exists():
+        if cube_version(cube_path) != version:
+            return None
+        tmp = staged.with_name(f"{staged.name}.{os.getpid()}.tmp")
+        try:
+            link_or_copy(cube_path, tmp)
+            os.replace(tmp, staged)
+        except FileNotFoundError:
+            return None
+    # The cube may have been replaced between the check and the link
+    if cube_version(staged) != version:
+        staged.unlink(missing_ok=True)
+        return None
+    return staged
+
+
+def load_cube(files: DataFiles) -> pl.LazyFrame | None:
+    """Return the cube built for `files` as a LazyFrame, or None when that version has none."""
+    if files.cube is None:
+        return None
+    if shared_enabled():
+        return scan_shared('cube', files.cube,
+                           lambda: encode_categoricals(pl.scan_parquet(files.cube), files.source))
+    return pl.scan_parquet(files.cube)
+
+
+def cube_slice(cube: pl.LazyFrame, drug: str | None, is_brand: bool | None, is_ffsu: bool | None) -> pl.LazyFrame:
+    """Select the cube rows answering a drug/brand/utilization filter.
+
+    A None filter selects the matching "all" rollup instead of scanning leaves.
+    """
+    data = cube.filter(c.rollup == rollup_mask(drug is None, is_brand is None, is_ffsu is None))
+
+    if drug is not None:
+        data = data.filter(c.description == drug)
+
+    if is_brand is not None:
+        data = data.filter(c.is_brand == is_brand)
+
+    if is_ffsu is not None:
+        data = data.filter(c.is_ffsu == is_ffsu)
+
+    return data
+
+
+def sink_cube(cube: pl.LazyFrame, output: Path, version: dict) -> None:
+    """Write cube rows to `output`, stamped with the source `version` they were built from.
+
+    Replaces `output` atomically; concurrent builds each write their own temp file.
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+    try:
+        (
+            cube
+            .sort(['rollup', 'year', 'quarter', 'description', 'state'])
+            .sink_parquet(tmp, statistics=True, metadata={VERSION_KEY: json.dumps(version)})
+        )
+        os.replace(tmp, output)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write_cube(source: Path = BASE_DATA, output: Path = CUBE_DATA) -> None:
+    """Build the cube from `source` and atomically replace `output`."""
+    # Read the version first: if the source changes mid-build the cube is simply stale
+    version = data_version(source)
+    sink_cube(build_cube(scan_source(source)), output, version)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the precomputed aggregate cube.")
+    parser.add_argument('--source', type=Path, default=BASE_DATA)
+    parser.add_argument('--output', type=Path, default=CUBE_DATA)
+    args = parser.parse_args()
+    write_cube(args.source, args.output)
+    print(f"Wrote {pl.scan_parquet(args.output).select(pl.len()).collect().item():,} cube rows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
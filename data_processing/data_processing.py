@@ -1,8 +1,10 @@
 import polars as pl
 from polars import col as c
-import polars.selectors as cs
-from data_processing.expressions import payment_per_unit, weighted_nadac_per_unit, markup_per_unit, markup_percentile, make_date, payment_per_unit_percentile, year_quarter
-from config import BASE_DATA
+from data_processing.expressions import make_date, year_quarter, with_per_unit_metrics, with_percentiles, with_quarter_changes
+from data_processing.engine import get_engine, load_base_data
+from data_processing.filters import FilterSpec, brand_filter
+from data_processing.reload import current_state
+from data_processing.search import DEFAULT_LIMIT, SearchResult
 from assets.states import STATE_ABBREV
 
 
@@ -16,113 +18,108 @@ def year_quarters() -> pl.LazyFrame:
         .sort(['year','quarter'])
     )
 
-def load_base_data() -> pl.LazyFrame:
-    df = pl.scan_parquet(BASE_DATA)
-    return df
-
 def year_quarter_list() -> list[str]:
-    """Return sorted unique year/quarter combinations as strings."""
-    return (
-        year_quarters()
-        .select('year_quarter')
-        .collect(engine='streaming')['year_quarter']
-        .to_list()
-    )
+    """Return sorted unique year/quarter combinations as strings, from the served data version."""
+    return list(current_state().metadata.year_quarters)
 
 def state_list() -> list[str]:
-    """Return sorted unique state values."""
-    return (
-        load_base_data()
-        .select(c.state)
-        .unique()
-        .with_columns(c.state.replace(STATE_ABBREV))
-        .sort('state')
-        .collect(engine='streaming')['state']
-        .to_list()
-    )
+    """Return sorted unique state values (rows without a state are left out)."""
+    return sorted(STATE_ABBREV.get(state, state) for state in current_state().metadata.states if state is not None)
 
 def drug_list(how: str = 'all') -> list[str]:
-    """Return sorted unique drug descriptions.
-    how: 'all' | 'brand' | 'generic' (case-insensitive, accepts plurals)
+    """Return sorted unique drug descriptions (rows without a description are left out).
+    how: 'all' | 'brand' | 'generic' (case-insensitive, accepts plurals); raises ValueError otherwise
     """
-    how = (how or 'all').strip().lower()
-    df = load_base_data()
+    is_brand = brand_filter(how, 'how')
+    metadata = current_state().metadata
 
-    if how in ('brand', 'brands'):
-        lf = df.filter(c.is_brand)
-    elif how in ('generic', 'generics'):
-        lf = df.filter(~c.is_brand)
+    if is_brand is True:
+        drugs = metadata.brand_drugs
+    elif is_brand is False:
+        drugs = metadata.generic_drugs
     else:
-        lf = df
+        drugs = sorted({*metadata.brand_drugs, *metadata.generic_drugs} - {None})
 
-    return (
-        lf
-        .select(c.description)
-        .unique()
-        .sort('description')
-        .collect(engine='streaming')['description']
-        .to_list()
-    )
+    return [drug for drug in drugs if drug is not None]
+
+def search_drugs(query: str | None, how: str = 'all', limit: int = DEFAULT_LIMIT, offset: int = 0) -> SearchResult:
+    """Return one page of drug descriptions matching `query`, filtered like `drug_list(how)`."""
+    return current_state().drug_index.search(query, brand_filter(how, 'how'), limit, offset)
 
+def top_drugs(n: int) -> list[str]:
+    """Return the `n` drugs with the highest total_amt summed across every quarter."""
+    return get_engine().top_drugs(n)
 
-def filter_map_data(year_quarter: str,drug: str | None, brand_generic: str | None, utilization_type: str | None) -> pl.LazyFrame:
+def _quarters(year_quarter: str) -> tuple[int, int, tuple[int, int]]:
+    """Return the year, quarter and previous (year, quarter) of a 'YYYY Qn' label."""
     year = int(year_quarter.split(' ')[0])
     quarter = int(year_quarter.split(' ')[1][1])
-    
-    data = (
-        load_base_data()
-        .filter(c.year == year)
-        .filter(c.quarter == quarter)
-    )
 
-    if drug is not None:
-        data = data.filter(c.description == drug)
+    previous = (year, quarter - 1) if quarter > 1 else (year - 1, 4)
+    return year, quarter, previous
 
-    if brand_generic is not None:
-        data = data.filter(c.is_brand if brand_generic == 'Brand' else ~c.is_brand)
-    
-    if utilization_type is not None:
-        data = data.filter(c.is_ffsu if utilization_type == 'Fee-for-Service' else ~c.is_ffsu)
-
-    data = (
-        data
-        .group_by(c.state)
-        .agg(cs.matches('(?i)rx|total|units').sum().round(4))
-        .with_columns(
-            payment_per_unit(),
-            markup_per_unit(),
-            markup_percentile(),
-            payment_per_unit_percentile()
-        )
+def _map_metrics(totals: pl.LazyFrame, year: int, quarter: int) -> pl.LazyFrame:
+    # Both quarters come back from one grouped query; the change columns are a
+    # per-state window over them, then only the selected quarter is kept
+    return (
+        totals
+        .pipe(with_per_unit_metrics)
+        .pipe(with_quarter_changes, 'payment_per_unit', 'markup_per_unit')
+        .filter(c.year == year, c.quarter == quarter)
+        .drop('year', 'quarter')
+        .pipe(with_percentiles)
     )
 
-    return data
+def _line_metrics(totals: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        totals
+        .select(make_date(), pl.exclude('year', 'quarter'))
+        .pipe(with_per_unit_metrics)
+        .sort('date')
+    )
 
-def filter_line_data(state: str,drug: str | None, brand_generic: str | None, utilization_type: str | None):
-    data = load_base_data().filter(c.weighted_nadac_total.is_not_null())
+def _with_source_rows(data: pl.LazyFrame, source_rows: bool) -> pl.LazyFrame:
+    # The engines' row counts feed the rows-scanned metric; they are not part of the data
+    return data if source_rows else data.drop('source_rows')
 
-    if state is not None:
-        data = data.filter(c.state == state)
+def filter_map_data(year_quarter: str, filters: FilterSpec, source_rows: bool = False) -> pl.LazyFrame:
+    """Return per-state map metrics for one quarter; `source_rows` keeps the base rows aggregated per state."""
+    year, quarter, previous = _quarters(year_quarter)
 
-    if drug is not None:
-        data = data.filter(c.description == drug)
+    data = _map_metrics(get_engine().map_totals([previous, (year, quarter)], filters.drug, filters.is_brand, filters.is_ffsu),
+                        year, quarter)
 
-    if brand_generic is not None:
-        data = data.filter(c.is_brand if brand_generic == 'Brand' else ~c.is_brand)
-    
-    if utilization_type is not None:
-        data = data.filter(c.is_ffsu if utilization_type == 'ffsu' else ~c.is_ffsu)
+    return _with_source_rows(data, source_rows)
 
+def filter_map_frames(filters: FilterSpec, source_rows: bool = False) -> pl.LazyFrame:
+    """Return map metrics for every quarter from one grouped query; percentiles rank within each quarter."""
     data = (
-        data
-        .group_by(make_date())
-        .agg(cs.matches('(?i)rx|total|units').sum().round(4))
-        .with_columns(
-            payment_per_unit(),
-            weighted_nadac_per_unit(),
-            markup_per_unit()
-        )
-        .sort('date')
+        get_engine()
+        .map_totals(None, filters.drug, filters.is_brand, filters.is_ffsu)
+        .with_columns(year_quarter())
+        .pipe(with_per_unit_metrics)
+        .pipe(with_percentiles, partition_by=['year', 'quarter'])
+        .pipe(with_quarter_changes, 'payment_per_unit', 'markup_per_unit')
+        .sort(['year', 'quarter', 'state'])
     )
 
-    return data
\ No newline at end of file
+    return _with_source_rows(data, source_rows)
+
+def filter_line_data(state: str | None, filters: FilterSpec, source_rows: bool = False) -> pl.LazyFrame:
+    data = _line_metrics(get_engine().line_totals(state, filters.drug, filters.is_brand, filters.is_ffsu))
+
+    return _with_source_rows(data, source_rows)
+
+def filter_chart_data(year_quarter: str, state: str | None, filters: FilterSpec,
+                      source_rows: bool = False) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Return filter_map_data and filter_line_data results together, from one scan of the filtered rows."""
+    year, quarter, previous = _quarters(year_quarter)
+
+    map_totals, line_totals = get_engine().map_and_line_totals([previous, (year, quarter)], state, filters.drug,
+                                                               filters.is_brand, filters.is_ffsu)
+
+    map_data, line_data = pl.collect_all([
+        _with_source_rows(_map_metrics(map_totals, year, quarter), source_rows),
+        _with_source_rows(_line_metrics(line_totals), source_rows),
+    ], engine='streaming')
+    return map_data, line_data
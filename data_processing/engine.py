@@ -0,0 +1,374 @@
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import polars as pl
+from polars import col as c
+import polars.selectors as cs
+from data_processing.cube import cube_is_current, cube_slice, load_cube, measures, rollup_mask
+from data_processing.metadata import Metadata, encode_categoricals, list_year_quarters, scan_metadata
+from data_processing.shared import build_lock, scan_shared, shared_enabled
+from data_processing.source import DataFiles, data_version, is_partitioned, prune_versions, scan_quarter, scan_source, version_tag
+from config import BASE_DATA, CUBE_DATA, DUCKDB_DIR, QUERY_ENGINE
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed for NADAC_QUERY_ENGINE=duckdb
+    duckdb = None
+
+
+def live_files() -> DataFiles:
+    """Return the data on disk right now (used until hot reload serves staged versions)."""
+    return DataFiles(data_version(), BASE_DATA, CUBE_DATA if cube_is_current() else None)
+
+
+_files: Callable[[], DataFiles] = live_files
+
+
+def serve_files(provider: Callable[[], DataFiles]) -> None:
+    """Query the files `provider()` returns from now on (hot reload passes the served state's)."""
+    global _files
+    _files = provider
+
+
+def current_files() -> DataFiles:
+    return _files()
+
+
+def load_base_data(files: DataFiles | None = None) -> pl.LazyFrame:
+    files = files or current_files()
+    if shared_enabled():
+        # The resident snapshot is Enum-encoded; per-query parquet scans stay strings,
+        # since casting there would hash every string on every query
+        return scan_shared('base', files.source,
+                           lambda: encode_categoricals(scan_source(files.source), files.source))
+    return scan_source(files.source)
+
+def load_quarter_data(year: int, quarter: int, files: DataFiles | None = None) -> pl.LazyFrame:
+    """Return one quarter of base data, from the shared snapshot or its own partition."""
+    files = files or current_files()
+    if shared_enabled():
+        return load_base_data(files).filter(c.year == year, c.quarter == quarter)
+    return scan_quarter(year, quarter, files.source)
+
+def _filter_raw(data: pl.LazyFrame, drug: str | None, is_brand: bool | None, is_ffsu: bool | None) -> pl.LazyFrame:
+    """Apply drug/brand/utilization filters to raw rows (used when no cube is built)."""
+    if drug is not None:
+        data = data.filter(c.description == drug)
+
+    if is_brand is not None:
+        data = data.filter(c.is_brand if is_brand else ~c.is_brand)
+
+    if is_ffsu is not None:
+        data = data.filter(c.is_ffsu if is_ffsu else ~c.is_ffsu)
+
+    return data
+
+
+def _source_rows(from_cube: bool) -> pl.Expr:
+    """Count the base data rows behind each group: the cube's stored counts, or the raw rows."""
+    return (c.source_rows.sum() if from_cube else pl.len()).cast(pl.UInt32).alias('source_rows')
+
+
+class PolarsEngine:
+    """Answer queries with Polars LazyFrames over the cube when built, else the base data.
+
+    Every engine returns summed measures plus `source_rows` (base data rows aggregated), per
+    year/quarter/state for the map (some or all quarters) and per year/quarter for
+    the line chart. Queries read `current_files()`, the served version's files.
+    """
+    name = 'polars'
+
+    def scan_metadata(self, files: DataFiles) -> Metadata:
+        return scan_metadata(files.source)
+
+    def map_totals(self, quarters: list[tuple[int, int]] | None, drug: str | None, is_brand: bool | None,
+                   is_ffsu: bool | None) -> pl.LazyFrame:
+        files = current_files()
+        cube = load_cube(files)
+        if cube is not None:
+            data = cube_slice(cube, drug, is_brand, is_ffsu)
+            if quarters is not None:
+                data = data.filter(pl.any_horizontal((c.year == year) & (c.quarter == quarter) for year, quarter in quarters))
+        elif quarters is not None:
+            # Opens only the requested partitions when the source is partitioned
+            data = _filter_raw(pl.concat([load_quarter_data(year, quarter, files) for year, quarter in quarters],
+                                         how='diagonal_relaxed'), drug, is_brand, is_ffsu)
+        else:
+            data = _filter_raw(load_base_data(files), drug, is_brand, is_ffsu)
+
+        return data.group_by(c.year, c.quarter, c.state).agg(measures().sum().round(4), _source_rows(cube is not None))
+
+    def line_totals(self, state: str | None, drug: str | None, is_brand: bool | None,
+                    is_ffsu: bool | None) -> pl.LazyFrame:
+        files = current_files()
+        cube = load_cube(files)
+        if cube is not None:
+            data = cube_slice(cube, drug, is_brand, is_ffsu).filter(c.has_nadac)
+        else:
+            data = _filter_raw(load_base_data(files).filter(c.weighted_nadac_total.is_not_null()), drug, is_brand, is_ffsu)
+
+        if state is not None:
+            data = data.filter(c.state == state)
+
+        return data.group_by(c.year, c.quarter).agg(measures().sum().round(4), _source_rows(cube is not None))
+
+    def map_and_line_totals(self, quarters: list[tuple[int, int]] | None, state: str | None, drug: str | None,
+                            is_brand: bool | None, is_ffsu: bool | None) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+        """Return map_totals and line_totals from one scan of the filtered rows.
+
+        The rows are summed once per year/quarter/state and priced flag (a few
+        thousand rows), and both aggregations fan out from that in memory. Polars
+        pushes each branch's own predicates into the scan, so two lazy branches
+        collected together would still read the data twice.
+        """
+        files = current_files()
+        cube = load_cube(files)
+        if cube is not None:
+            data = cube_slice(cube, drug, is_brand, is_ffsu).with_columns(c.has_nadac.alias('priced'))
+        else:
+            data = _filter_raw(load_base_data(files), drug, is_brand, is_ffsu).with_columns(
+                c.weighted_nadac_total.is_not_null().alias('priced'))
+
+        totals = (
+            data
+            .group_by(c.year, c.quarter, c.state, c.priced)
+            .agg(measures().sum(), _source_rows(cube is not None))
+            .collect(engine='streaming')
+            .lazy()
+        )
+        sums = [measures().sum().round(4), c.source_rows.sum().cast(pl.UInt32)]
+        if quarters is not None:
+            map_data = totals.filter(pl.any_horizontal((c.year == year) & (c.quarter == quarter) for year, quarter in quarters))
+        else:
+            map_data = totals
+        line_data = totals.filter(c.priced) if state is None else totals.filter(c.priced, c.state == state)
+        return (
+            map_data.group_by(c.year, c.quarter, c.state).agg(*sums),
+            line_data.group_by(c.year, c.quarter).agg(*sums),
+        )
+
+    def top_drugs(self, n: int) -> list[str]:
+        files = current_files()
+        cube = load_cube(files)
+        if cube is not None:
+            data = cube.filter(c.rollup == rollup_mask(False, True, True))
+        else:
+            data = load_base_data(files)
+
+        return (
+            data
+            .group_by(c.description)
+            .agg(c.total_amt.sum())
+            .top_k(n, by='total_amt')
+            .sort('total_amt', descending=True)
+            .collect(engine='streaming')
+            ['description']
+            .to_list()
+        )
+
+
+def _sql_path(path: Path) -> str:
+    return "'" + str(path).replace("'", "''") + "'"
+
+
+@dataclass(frozen=True)
+class _Database:
+    """A read-only connection to one data version's database and what it contains."""
+    connection: object
+    has_cube: bool
+    measures: tuple[str, ...]
+    integer_measures: frozenset[str]
+
+    def cursor(self):
+        return self.connection.cursor()
+
+    def filters(self, drug: str | None, is_brand: bool | None, is_ffsu: bool | None) -> tuple[str, list[str], list]:
+        """Return the table plus WHERE clauses and parameters for the drug/brand/utilization filters."""
+        if self.has_cube:
+            table, where, params = 'cube', ['rollup = ?'], [rollup_mask(drug is None, is_brand is None, is_ffsu is None)]
+        else:
+            table, where, params = 'base', [], []
+        for name, value in (('description', drug), ('is_brand', is_brand), ('is_ffsu', is_ffsu)):
+            if value is not None:
+                where.append(f"{name} = ?")
+                params.append(value)
+        return table, where, params
+
+    def totals(self, keys: list[str], table: str, where: list[str], params: list) -> pl.LazyFrame:
+        """Sum every measure per `keys`, matching the Polars engine's rounding and dtypes."""
+        sums = [
+            f'round(coalesce(sum("{name}"), 0), 4)::{"BIGINT" if name in self.integer_measures else "DOUBLE"} AS "{name}"'
+            for name in self.measures
+        ]
+        # Cube rows carry the number of base rows summed into them
+        rows = 'sum(source_rows)' if table == 'cube' else 'count(*)'
+        sql = (
+            f"SELECT {', '.join(keys)}, {', '.join(sums)}, {rows}::UINTEGER AS source_rows FROM {table} "
+            f"WHERE {' AND '.join(where) or 'true'} GROUP BY {', '.join(keys)}"
+        )
+        with self.cursor() as cursor:
+            return cursor.execute(sql, params).pl().lazy()
+
+
+class DuckDBEngine:
+    """Answer queries in an embedded DuckDB database loaded from the base data (and cube).
+
+    Each data version is loaded once into its own database file under `directory`,
+    sorted so DuckDB's per-block min/max indexes skip most of the table for a
+    quarter or drug filter, then opened read-only by every worker. Connections to
+    the previous version stay open for requests still reading it.
+    """
+    name = 'duckdb'
+
+    def __init__(self, directory: Path = DUCKDB_DIR):
+        if duckdb is None:
+            raise RuntimeError("NADAC_QUERY_ENGINE=duckdb requires the duckdb package (pip install duckdb)")
+        self.directory = directory
+        self._databases: dict[Path, _Database] = {}
+        self._lock = threading.Lock()
+        self._path_locks: dict[Path, threading.Lock] = {}
+
+    def _database_path(self, files: DataFiles) -> Path:
+        # The cube is keyed in too, so building it later yields a new database
+        suffix = '-cube' if files.cube is not None else ''
+        return self.directory / f"heat_map-{version_tag(files.version)}{suffix}.duckdb"
+
+    def _build(self, path: Path, files: DataFiles) -> None:
+        source = files.source / '**' / '*.parquet' if is_partitioned(files.source) else files.source
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.unlink(missing_ok=True)
+        with duckdb.connect(str(tmp)) as connection:
+            connection.execute(
+                f"CREATE TABLE base AS SELECT * FROM read_parquet({_sql_path(source)}, hive_partitioning = true) "
+                "ORDER BY year, quarter, description, state"
+            )
+            if files.cube is not None:
+                connection.execute(
+                    f"CREATE TABLE cube AS SELECT * FROM read_parquet({_sql_path(files.cube)}) "
+                    "ORDER BY rollup, year, quarter, description, state"
+                )
+        os.replace(tmp, path)
+        # Workers still attached to a removed file keep reading it until they reconnect
+        prune_versions(list(self.directory.glob('heat_map-*.duckdb')))
+
+    def database(self, files: DataFiles | None = None) -> _Database:
+        """Return the database for `files` (default: the served version), building it on first use.
+
+        `_lock` only guards the open databases; building or opening one version
+        holds that version's own lock, so queries against the others never wait on it.
+        """
+        files = files or current_files()
+        path = self._database_path(files)
+        with self._lock:
+            database = self._databases.get(path)
+            if database is not None:
+                return database
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+        with path_lock:
+            with self._lock:
+                database = self._databases.get(path)
+            if database is None:
+                if not path.exists():
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    with build_lock(self.directory):
+                        if not path.exists():
+                            self._build(path, files)
+                database = self._open(path, files)
+                with self._lock:
+                    self._databases[path] = database
+                    # Keep the newest two versions open; older connections close once
+                    # in-flight queries release them
+                    for stale in list(self._databases)[:-2]:
+                        del self._databases[stale]
+                        self._path_locks.pop(stale, None)
+        return database
+
+    @staticmethod
+    def _open(path: Path, files: DataFiles) -> _Database:
+        connection = duckdb.connect(str(path), read_only=True)
+        schema = connection.sql("SELECT * FROM base LIMIT 0").pl().schema
+        names = cs.expand_selector(schema, measures())
+        return _Database(
+            connection=connection,
+            has_cube=files.cube is not None,
+            measures=names,
+            integer_measures=frozenset(name for name in names if schema[name].is_integer()),
+        )
+
+    def scan_metadata(self, files: DataFiles) -> Metadata:
+        with self.database(files).cursor() as cursor:
+            states = cursor.execute("SELECT DISTINCT state FROM base ORDER BY state NULLS FIRST").fetchall()
+            drugs = cursor.execute(
+                "SELECT DISTINCT description, is_brand FROM base ORDER BY description NULLS FIRST"
+            ).fetchall()
+            quarters = cursor.execute("SELECT DISTINCT year, quarter FROM base ORDER BY year, quarter").fetchall()
+        return Metadata(
+            year_quarters=(list_year_quarters(files.source) if is_partitioned(files.source)
+                           else [f"{year} Q{quarter}" for year, quarter in quarters]),
+            states=[state for (state,) in states],
+            brand_drugs=[description for description, is_brand in drugs if is_brand],
+            generic_drugs=[description for description, is_brand in drugs if is_brand is False],
+        )
+
+    def map_totals(self, quarters: list[tuple[int, int]] | None, drug: str | None, is_brand: bool | None,
+                   is_ffsu: bool | None) -> pl.LazyFrame:
+        database = self.database()
+        table, where, params = database.filters(drug, is_brand, is_ffsu)
+        if quarters is not None:
+            where.append('(' + ' OR '.join(['(year = ? AND quarter = ?)'] * len(quarters)) + ')')
+            params += [value for year_quarter in quarters for value in year_quarter]
+        return database.totals(['year', 'quarter', 'state'], table, where, params)
+
+    def line_totals(self, state: str | None, drug: str | None, is_brand: bool | None,
+                    is_ffsu: bool | None) -> pl.LazyFrame:
+        database = self.database()
+        table, where, params = database.filters(drug, is_brand, is_ffsu)
+        where.append('has_nadac' if table == 'cube' else 'weighted_nadac_total IS NOT NULL')
+        if state is not None:
+            where.append('state = ?')
+            params.append(state)
+        return database.totals(['year', 'quarter'], table, where, params)
+
+    def map_and_line_totals(self, quarters: list[tuple[int, int]] | None, state: str | None, drug: str | None,
+                            is_brand: bool | None, is_ffsu: bool | None) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+        # Two queries: each reads only the blocks its own filters select
+        return self.map_totals(quarters, drug, is_brand, is_ffsu), self.line_totals(state, drug, is_brand, is_ffsu)
+
+    def top_drugs(self, n: int) -> list[str]:
+        database = self.database()
+        if database.has_cube:
+            table, where, params = 'cube', ['rollup = ?'], [rollup_mask(False, True, True)]
+        else:
+            table, where, params = 'base', ['true'], []
+        with database.cursor() as cursor:
+            rows = cursor.execute(
+                f"SELECT description FROM {table} WHERE {' AND '.join(where)} "
+                "GROUP BY description ORDER BY sum(total_amt) DESC NULLS LAST LIMIT ?",
+                params + [n],
+            ).fetchall()
+        return [description for (description,) in rows]
+
+
+ENGINES = {'polars': PolarsEngine, 'duckdb': DuckDBEngine}
+
+_engines: dict[str, PolarsEngine | DuckDBEngine] = {}
+_selected = QUERY_ENGINE
+
+
+def select_engine(name: str) -> None:
+    """Switch the engine used by the data_processing query functions (e.g. from benchmarks)."""
+    global _selected
+    _selected = name
+
+
+def get_engine() -> PolarsEngine | DuckDBEngine:
+    """Return the selected engine, created once per process."""
+    if _selected not in ENGINES:
+        raise ValueError(f"Unknown query engine {_selected!r}; expected one of {', '.join(ENGINES)}")
+    engine = _engines.get(_selected)
+    if engine is None:
+        engine = _engines[_selected] = ENGINES[_selected]()
+    return engine
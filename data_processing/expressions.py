@@ -2,6 +2,11 @@ import polars as pl
 from polars import col as c
 import polars.selectors as cs
 
+# Derived metrics are composed in layers: each layer's expressions read the
+# columns added by the layer before, so every per-unit value, rank and window
+# is evaluated once instead of being rebuilt inside each expression that uses it.
+# Use the with_* helpers below rather than mixing layers in one with_columns.
+
 def year_quarter() -> pl.Expr:
     """Return a year/quarter expression."""
     return pl.format("{} Q{}", c.year, c.quarter).alias('year_quarter')
@@ -15,18 +20,27 @@ def weighted_nadac_per_unit() -> pl.Expr:
     return (cs.matches('(?i)nadac.*total') / c.units).round(4).alias('weighted_nadac_per_unit')
 
 def markup_per_unit() -> pl.Expr:
-    """Return a markup per unit expression."""
-    return payment_per_unit().sub(weighted_nadac_per_unit()).round(4).alias('markup_per_unit')
+    """Return a markup per unit expression (reads the per-unit columns)."""
+    return (c.payment_per_unit - c.weighted_nadac_per_unit).round(4).alias('markup_per_unit')
+
+def _over(expr: pl.Expr, partition_by: list[str] | None) -> pl.Expr:
+    return expr if partition_by is None else expr.over(partition_by)
+
+def markup_rank(partition_by: list[str] | None = None) -> pl.Expr:
+    return _over(c.markup_per_unit.rank(descending=False), partition_by).alias('markup_rank')
 
-def markup_rank() -> pl.Expr:
-    return markup_per_unit().rank(descending=False).alias('markup_rank')
+def payment_per_unit_rank(partition_by: list[str] | None = None) -> pl.Expr:
+    return _over(c.payment_per_unit.rank(descending=False), partition_by).alias('payment_per_unit_rank')
 
-def markup_percentile() -> pl.Expr:
-    percentile = ((markup_rank()-1) / markup_rank().max())
-    return pl.when(percentile < .01).then(0.01).otherwise(percentile).round(2).alias('markup_percentile')
+def _percentile(rank: str, partition_by: list[str] | None) -> pl.Expr:
+    """(rank - 1) / max rank, floored at 0.01, from an existing rank column."""
+    return ((pl.col(rank) - 1) / _over(pl.col(rank).max(), partition_by)).clip(lower_bound=0.01).round(2)
 
-def payment_per_unit_rank() -> pl.Expr:
-    return payment_per_unit().rank(descending=False).alias('payment_per_unit_rank')
+def markup_percentile(partition_by: list[str] | None = None) -> pl.Expr:
+    return _percentile('markup_rank', partition_by).alias('markup_percentile')
+
+def payment_per_unit_percentile(partition_by: list[str] | None = None) -> pl.Expr:
+    return _percentile('payment_per_unit_rank', partition_by).alias('payment_per_unit_percentile')
 
 def convert_quarter_to_month() -> pl.Expr:
     return (c.quarter - 1) * 3 + 1
@@ -34,6 +48,48 @@ def convert_quarter_to_month() -> pl.Expr:
 def make_date() -> pl.Expr:
     return pl.datetime(c.year, convert_quarter_to_month(), 1).alias('date')
 
-def payment_per_unit_percentile() -> pl.Expr:
-    percentile = ((payment_per_unit_rank()-1) / payment_per_unit_rank().max())
-    return pl.when(percentile < .01).then(0.01).otherwise(percentile).round(2).alias('payment_per_unit_percentile')
\ No newline at end of file
+def quarter_index() -> pl.Expr:
+    """Return a running quarter number, so adjacent quarters differ by one."""
+    return (c.year * 4 + c.quarter).alias('quarter_index')
+
+def previous_quarter_index() -> pl.Expr:
+    """Return the quarter_index of the same state's previous row (reads quarter_index)."""
+    return c.quarter_index.shift(1).over('state', order_by=c.quarter_index).alias('previous_quarter_index')
+
+def change_vs_previous_quarter(metric: str) -> pl.Expr:
+    """Return `metric` minus its value for the same state in the previous quarter (null if that quarter is absent)."""
+    previous = pl.col(metric).shift(1).over('state', order_by=c.quarter_index)
+    return (
+        pl.when(c.previous_quarter_index == c.quarter_index - 1)
+        .then(pl.col(metric) - previous)
+        .round(4)
+        .alias(f'{metric}_change')
+    )
+
+
+def with_per_unit_metrics(data: pl.LazyFrame) -> pl.LazyFrame:
+    """Add payment, weighted NADAC and markup per unit from the summed totals."""
+    return (
+        data
+        .with_columns(payment_per_unit(), weighted_nadac_per_unit())
+        .with_columns(markup_per_unit())
+    )
+
+def with_percentiles(data: pl.LazyFrame, partition_by: list[str] | None = None) -> pl.LazyFrame:
+    """Add markup and payment percentiles, ranked over all rows or within each `partition_by` group."""
+    return (
+        data
+        .with_columns(markup_rank(partition_by), payment_per_unit_rank(partition_by))
+        .with_columns(markup_percentile(partition_by), payment_per_unit_percentile(partition_by))
+        .drop('markup_rank', 'payment_per_unit_rank')
+    )
+
+def with_quarter_changes(data: pl.LazyFrame, *metrics: str) -> pl.LazyFrame:
+    """Add `<metric>_change` vs the previous quarter for each state."""
+    return (
+        data
+        .with_columns(quarter_index())
+        .with_columns(previous_quarter_index())
+        .with_columns(change_vs_previous_quarter(metric) for metric in metrics)
+        .drop('quarter_index', 'previous_quarter_index')
+    )
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+
+from assets.states import STATE_BY_NAME
+
+# Accepted spellings (case-insensitive) of the brand and utilization filters; None means no filter
+BRAND_VALUES = {'all': None, 'brand': True, 'brands': True, 'generic': False, 'generics': False}
+UTILIZATION_VALUES = {'all': None, 'fee-for-service': True, 'ffsu': True, 'managed care': False, 'mcou': False}
+
+
+def _parse(value: str | None, values: dict[str, bool | None], name: str) -> bool | None:
+    key = (value or 'all').strip().lower()
+    if key not in values:
+        raise ValueError(f"{name} must be one of {', '.join(values)}")
+    return values[key]
+
+
+def brand_filter(value: str | None, name: str = 'brand') -> bool | None:
+    """Return the is_brand filter for a brand value ('all' | 'brand' | 'generic', case-insensitive, plurals).
+
+    Raises ValueError for an unrecognized value.
+    """
+    return _parse(value, BRAND_VALUES, name)
+
+
+def state_abbreviation(state: str | None) -> str | None:
+    """Return the abbreviation for a full state name; abbreviations and None pass through."""
+    return STATE_BY_NAME.get(state, state)
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Drug, brand and utilization filters shared by the map and line chart queries.
+
+    Build it with `from_values` so every spelling of a filter maps to one value;
+    being frozen, it is hashable and doubles as part of a result cache key.
+    """
+    drug: str | None = None
+    is_brand: bool | None = None
+    is_ffsu: bool | None = None
+
+    @classmethod
+    def from_values(cls, drug: str | None, brand_generic: str | None, utilization_type: str | None) -> 'FilterSpec':
+        """Normalize dropdown or query-string values: 'Brand' | 'Generic' and 'Fee-for-Service' | 'Managed Care'.
+
+        Raises ValueError for an unrecognized brand or utilization value.
+        """
+        return cls(
+            drug=drug or None,
+            is_brand=brand_filter(brand_generic),
+            is_ffsu=_parse(utilization_type, UTILIZATION_VALUES, 'utilization'),
+        )
@@ -0,0 +1,181 @@
+import argparse
+from pathlib import Path
+
+import polars as pl
+from polars import col as c
+from data_processing.cube import build_cube, cube_is_current, sink_cube
+from data_processing.rewrite import DEFAULT_ROW_GROUP_SIZE, write_quarter
+from data_processing.source import PARTITION_SCHEMA, data_version, is_partitioned, partition_path, partition_year_quarters, scan_quarter
+from config import BASE_DATA, CUBE_DATA
+
+# CMS State Drug Utilization Data (SDUD) columns used, renamed to ours
+SDUD_COLUMNS = {
+    'Utilization Type': 'utilization_type',
+    'State': 'state',
+    'NDC': 'ndc',
+    'Year': 'year',
+    'Quarter': 'quarter',
+    'Suppression Used': 'suppressed',
+    'Units Reimbursed': 'units',
+    'Number of Prescriptions': 'rx_ct',
+    'Total Amount Reimbursed': 'total_amt',
+}
+# CMS NADAC weekly file columns used, renamed to ours
+NADAC_COLUMNS = {
+    'NDC Description': 'description',
+    'NDC': 'ndc',
+    'NADAC Per Unit': 'nadac_per_unit',
+    'Effective Date': 'effective_date',
+    'Classification for Rate Setting': 'classification',
+}
+NADAC_DATE_FORMAT = '%m/%d/%Y'
+# SDUD reports a national total under this pseudo-state
+NATIONAL_STATE = 'XX'
+BASE_SCHEMA = {
+    **PARTITION_SCHEMA, 'state': pl.String, 'description': pl.String,
+    'is_brand': pl.Boolean, 'is_ffsu': pl.Boolean, 'rx_ct': pl.Int64, 'units': pl.Float64,
+    'total_amt': pl.Float64, 'weighted_nadac_total': pl.Float64,
+}
+
+
+def _ndc() -> pl.Expr:
+    """Normalize an NDC to the 11-digit, dash-free form both files are joined on."""
+    return c.ndc.str.replace_all('-', '').str.zfill(11)
+
+
+def scan_sdud(paths: list[Path]) -> pl.LazyFrame:
+    """Scan SDUD CSVs into per-NDC utilization rows, dropping suppressed and national rows."""
+    return (
+        pl.scan_csv(paths, infer_schema=False)
+        .select(pl.col(list(SDUD_COLUMNS)).name.map(SDUD_COLUMNS.get))
+        .filter(c.state != NATIONAL_STATE, c.suppressed.str.to_lowercase() != 'true')
+        .select(
+            c.year.cast(PARTITION_SCHEMA['year']),
+            c.quarter.cast(PARTITION_SCHEMA['quarter']),
+            c.state,
+            _ndc(),
+            (c.utilization_type == 'FFSU').alias('is_ffsu'),
+            c.rx_ct.cast(pl.Float64).cast(pl.Int64),
+            c.units.cast(pl.Float64),
+            c.total_amt.cast(pl.Float64),
+        )
+    )
+
+
+def scan_nadac(paths: list[Path]) -> pl.LazyFrame:
+    """Scan NADAC CSVs into (ndc, description, is_brand, nadac_per_unit, effective_date) rows."""
+    return (
+        pl.scan_csv(paths, infer_schema=False)
+        .select(pl.col(list(NADAC_COLUMNS)).name.map(NADAC_COLUMNS.get))
+        .select(
+            _ndc(),
+            c.description.str.strip_chars(),
+            # B, B-ANDA and B-BIO are all rated as brands
+            c.classification.str.starts_with('B').alias('is_brand'),
+            c.nadac_per_unit.cast(pl.Float64),
+            c.effective_date.str.to_date(NADAC_DATE_FORMAT),
+        )
+    )
+
+
+def nadac_for_quarter(nadac: pl.LazyFrame, year: int, quarter: int) -> pl.LazyFrame:
+    """Return one row per NDC: its latest description and brand rating, and the NADAC effective at quarter end."""
+    quarter_end = pl.date(year, quarter * 3, 1).dt.month_end()
+    catalog = nadac.group_by(c.ndc).agg(
+        c.description.sort_by(c.effective_date).last(),
+        c.is_brand.sort_by(c.effective_date).last(),
+    )
+    prices = (
+        nadac
+        .filter(c.effective_date <= quarter_end)
+        .group_by(c.ndc)
+        .agg(c.nadac_per_unit.sort_by(c.effective_date).last())
+    )
+    return catalog.join(prices, on='ndc', how='left')
+
+
+def build_quarter(sdud: pl.LazyFrame, nadac: pl.LazyFrame, year: int, quarter: int) -> pl.LazyFrame:
+    """Join one quarter of SDUD to NADAC and aggregate it to the base data schema.
+
+    `weighted_nadac_total` is units times the NADAC per unit in effect at quarter
+    end, and stays null for rows without one so the line chart can exclude them.
+    NDCs that never appear in NADAC have no description and are dropped.
+    """
+    return (
+        sdud
+        .filter(c.year == year, c.quarter == quarter)
+        .join(nadac_for_quarter(nadac, year, quarter), on='ndc', how='inner')
+        .with_columns(
+            (c.units * c.nadac_per_unit).alias('weighted_nadac_total'),
+            c.nadac_per_unit.is_not_null().alias('has_nadac'),
+        )
+        .group_by('year', 'quarter', 'state', 'description', 'is_brand', 'is_ffsu', 'has_nadac')
+        .agg(c.rx_ct.sum(), c.units.sum(), c.total_amt.sum(), c.weighted_nadac_total.sum())
+        .with_columns(pl.when(c.has_nadac).then(c.weighted_nadac_total).alias('weighted_nadac_total'))
+        .select(pl.col(name).cast(dtype) for name, dtype in BASE_SCHEMA.items())
+    )
+
+
+def append_cube(quarters: list[tuple[int, int]], source: Path = BASE_DATA, cube: Path = CUBE_DATA) -> None:
+    """Add cube rows for newly written quarters, copying the existing rows unchanged.
+
+    Cube rows never span quarters, so the new rows come from the new partitions alone.
+    """
+    version = data_version(source)
+    new_rows = [build_cube(scan_quarter(year, quarter, source)) for year, quarter in quarters]
+    sink_cube(pl.concat([pl.scan_parquet(cube), *new_rows], how='vertical_relaxed'), cube, version)
+
+
+def ingest(sdud_paths: list[Path], nadac_paths: list[Path], source: Path = BASE_DATA, cube: Path = CUBE_DATA,
+           row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> list[tuple[int, int]]:
+    """Append the SDUD quarters not yet in `source` as new partitions and extend the cube.
+
+    Existing partitions are never read or rewritten. Returns the quarters added.
+    """
+    if source.exists() and not is_partitioned(source):
+        raise ValueError(f"{source} is a single file; convert it once with "
+                         f"`python -m data_processing.rewrite --partitioned --output <dir>` to append quarters")
+
+    existing = set(partition_year_quarters(source)) if source.exists() else set()
+    sdud = scan_sdud(sdud_paths)
+    nadac = scan_nadac(nadac_paths)
+    available = sdud.select(c.year, c.quarter).unique().sort(['year', 'quarter']).collect(engine='streaming')
+    quarters = [(year, quarter) for year, quarter in available.iter_rows() if (year, quarter) not in existing]
+
+    # Only extend a cube that already covers every existing quarter
+    extend_cube = bool(existing) and cube_is_current(cube, source)
+
+    for year, quarter in quarters:
+        partition = partition_path(year, quarter, source)
+        partition.mkdir(parents=True, exist_ok=True)
+        write_quarter(build_quarter(sdud, nadac, year, quarter), partition / 'data.parquet', row_group_size)
+
+    if quarters and extend_cube:
+        append_cube(quarters, source, cube)
+    return quarters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Append new CMS SDUD quarters, NADAC-weighted, to the base data and cube.")
+    parser.add_argument('--sdud', type=Path, nargs='+', required=True, help="SDUD quarterly CSV file(s)")
+    parser.add_argument('--nadac', type=Path, nargs='+', required=True, help="NADAC CSV file(s) covering those quarters")
+    parser.add_argument('--source', type=Path, default=BASE_DATA, help="Hive-partitioned base data directory")
+    parser.add_argument('--cube', type=Path, default=CUBE_DATA)
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    try:
+        quarters = ingest(args.sdud, args.nadac, args.source, args.cube, args.row_group_size)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if not quarters:
+        print(f"No new quarters; {args.source} is up to date")
+        return
+    print(f"Appended {', '.join(f'{year} Q{quarter}' for year, quarter in quarters)} to {args.source}")
+    if not cube_is_current(args.cube, args.source):
+        print(f"Cube {args.cube} is missing or stale; rebuild it with `python -m data_processing.cube`")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import json
+import os
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable
+
+import polars as pl
+from polars import col as c
+from data_processing.expressions import year_quarter
+from data_processing.source import data_version, is_partitioned, partition_year_quarters, scan_source
+from config import BASE_DATA, METADATA_CACHE
+
+
+@dataclass(frozen=True)
+class Metadata:
+    """Dropdown domains for one version of the base data."""
+    year_quarters: list[str]
+    states: list[str]
+    brand_drugs: list[str]
+    generic_drugs: list[str]
+
+
+_loaded: tuple[dict, Metadata] | None = None
+
+
+def list_year_quarters(source: Path = BASE_DATA) -> list[str]:
+    """Return quarters from the partition directory listing (no parquet reads)."""
+    return [f"{year} Q{quarter}" for year, quarter in partition_year_quarters(source)]
+
+
+def scan_metadata(source: Path = BASE_DATA) -> Metadata:
+    """Compute every dropdown domain from a single shared scan of `source`.
+
+    For a partitioned source the quarters come from the directory listing instead.
+    """
+    base = scan_source(source)
+    queries = [
+        base.select(c.state).unique().sort('state'),
+        base.select(c.description, c.is_brand).unique().sort('description'),
+    ]
+    if not is_partitioned(source):
+        queries.append(base.select(c.year, c.quarter).unique().sort(['year', 'quarter']).select(year_quarter()))
+
+    states, drugs, *year_quarters = pl.collect_all(queries)
+    return Metadata(
+        year_quarters=year_quarters[0]['year_quarter'].to_list() if year_quarters else list_year_quarters(source),
+        states=states['state'].to_list(),
+        brand_drugs=drugs.filter(c.is_brand)['description'].to_list(),
+        generic_drugs=drugs.filter(~c.is_brand)['description'].to_list(),
+    )
+
+
+def _read_sidecar(version: dict) -> Metadata | None:
+    try:
+        cached = json.loads(METADATA_CACHE.read_text())
+    except (OSError, ValueError):
+        return None
+    if cached.get('version') != version:
+        return None
+    return Metadata(**cached['metadata'])
+
+
+def _write_sidecar(version: dict, metadata: Metadata) -> None:
+    tmp = METADATA_CACHE.with_name(f"{METADATA_CACHE.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(json.dumps({'version': version, 'metadata': asdict(metadata)}))
+        os.replace(tmp, METADATA_CACHE)
+    except OSError:
+        # A read-only data directory only costs us the sidecar, not the answer.
+        tmp.unlink(missing_ok=True)
+
+
+def load_metadata(source: Path = BASE_DATA, scan: Callable[[], Metadata] | None = None) -> Metadata:
+    """Return metadata for `source`, calling `scan` (default: scan_metadata) only when the sidecar is stale."""
+    global _loaded
+    version = data_version(source)
+    if _loaded is not None and _loaded[0] == version:
+        return _loaded[1]
+
+    metadata = _read_sidecar(version)
+    if metadata is None:
+        metadata = scan() if scan is not None else scan_metadata(source)
+        _write_sidecar(version, metadata)
+
+    _loaded = (version, metadata)
+    return metadata
+
+
+def enum_dtypes(source: Path = BASE_DATA) -> dict[str, pl.Enum]:
+    """Return fixed-domain Enum dtypes for the state and description columns of `source`.
+
+    The domains hold every value in the data, not the dropdown lists: a drug whose
+    is_brand is null is in neither drug list, and a strict cast must not miss it.
+    """
+    base = scan_source(source)
+    states, descriptions = pl.collect_all([
+        base.select(c.state.drop_nulls().unique().sort()),
+        base.select(c.description.drop_nulls().unique().sort()),
+    ])
+    return {'state': pl.Enum(states['state']), 'description': pl.Enum(descriptions['description'])}
+
+
+def encode_categoricals(data: pl.LazyFrame, source: Path = BASE_DATA) -> pl.LazyFrame:
+    """Cast state and description to the Enum dtypes of the base data at `source`.
+
+    Filters then compare integer codes (a value outside the domain matches no
+    rows) and group-bys hash them, and a materialized copy stores each string
+    once. Categories are sorted, so sorting by code matches sorting by string.
+    """
+    return data.cast(enum_dtypes(source))
@@ -0,0 +1,239 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
+
+from data_processing.cube import cube_version, load_cube, stage_cube, write_cube
+from data_processing.engine import get_engine, serve_files
+from data_processing.metadata import Metadata, load_metadata
+from data_processing.result_cache import result_cache
+from data_processing.search import DrugIndex
+from data_processing.shared import build_lock, shared_enabled
+from data_processing.source import (DataFiles, data_version, publish_version, published_version, stage_source,
+                                    staged_source)
+from config import CUBE_DATA, RELOAD_INTERVAL, VERSIONS_DIR
+
+logger = logging.getLogger('nadac.reload')
+
+
+@dataclass(frozen=True)
+class DataState:
+    """Everything derived from one version of the base data, swapped in as a unit.
+
+    `files` are that version's staged base data and cube, which every query reads;
+    None for a static bundle, which never queries.
+    """
+    version: dict
+    metadata: Metadata
+    drug_index: DrugIndex
+    files: DataFiles | None = None
+
+
+_state: DataState | None = None
+_state_lock = threading.Lock()
+_watcher: threading.Thread | None = None
+_pinned = False
+_warmers: list[Callable[[DataState], None]] = []
+_ready = threading.Event()
+_warmup_failed = False
+_serving: ContextVar[DataState | None] = ContextVar('nadac_serving', default=None)
+
+
+def register_warmer(warmer: Callable[[DataState], None]) -> None:
+    """Run `warmer(state)` on every new data version before it is swapped in."""
+    _warmers.append(warmer)
+
+
+def prepare_state(rebuild_cube: bool = False, version: dict | None = None) -> DataState:
+    """Build derived state for the data currently on disk, or for an already staged `version`.
+
+    The base data (and the cube, when it was built from it) is staged under
+    VERSIONS_DIR first, so the state keeps reading the same files however the
+    data on disk changes. `rebuild_cube` refreshes a stale aggregate cube first;
+    only the watcher does this, since it runs off the request path.
+    """
+    if version is None:
+        source, version = stage_source()
+    else:
+        source = staged_source(version)
+        if not source.exists():
+            raise FileNotFoundError(f"Data version {version} is not staged under {VERSIONS_DIR}")
+    if rebuild_cube and CUBE_DATA.exists() and cube_version() != version:
+        with build_lock(CUBE_DATA.parent):
+            if cube_version() != version:
+                write_cube(source)
+    files = DataFiles(version, source, stage_cube(source, version))
+    if shared_enabled():
+        # Materialize the shared snapshot now rather than on the first request
+        load_cube(files)
+    metadata = load_metadata(source, lambda: get_engine().scan_metadata(files))
+    return DataState(version=version, metadata=metadata, drug_index=DrugIndex(metadata), files=files)
+
+
+def _warm(state: DataState) -> None:
+    with serving(state):
+        for warmer in _warmers:
+            warmer(state)
+
+
+def _served_state() -> DataState:
+    global _state
+    # With the watcher running, it prepares and warms each published version in the
+    # background and swaps it in; without it, the request that sees new data on disk does
+    follows_disk = not _pinned and _watcher is None
+    state = _state
+    if state is not None and (not follows_disk or state.version == data_version()):
+        return state
+    with _state_lock:
+        if _state is None:
+            _state = prepare_state(version=published_version() if _watcher is not None else None)
+        elif follows_disk and _state.version != data_version():
+            try:
+                _state = prepare_state()
+            except Exception:
+                # E.g. files mid-copy: keep serving the old state, retry on the next request
+                logger.exception("Could not load the data on disk; still serving %s", _state.version)
+        return _state
+
+
+def current_state() -> DataState:
+    """Return the data state to query: the one pinned by `serving`, else the served state.
+
+    With the watcher running the served state is the version published under
+    VERSIONS_DIR, shared by every worker, swapped in once this worker's watcher
+    has prepared and warmed it; otherwise it follows the data on disk, rebuilding
+    on the request that first sees a change.
+    """
+    return _serving.get() or _served_state()
+
+
+@contextmanager
+def serving(state: DataState | None = None):
+    """Query `state` (default: the served state) for the duration of the block, in this thread.
+
+    A request then reads one data version throughout, even if another is swapped
+    in meanwhile; warmers use it to query a version that is not served yet.
+    """
+    state = state or current_state()
+    token = _serving.set(state)
+    try:
+        yield state
+    finally:
+        _serving.reset(token)
+
+
+def served_version() -> dict:
+    """Return the version this worker serves (ignoring any `serving` pin)."""
+    return _served_state().version
+
+
+@contextmanager
+def _pin_served():
+    with serving() as state:
+        yield state.version
+
+
+def pin_state(state: DataState) -> None:
+    """Serve `state` from now on without looking at the data on disk (static bundle mode)."""
+    global _state, _pinned
+    with _state_lock:
+        _state = state
+        _pinned = True
+    _ready.set()
+
+
+def _publish_new_data() -> DataState | None:
+    """Stage, warm and publish the data on disk if it is newer than the published version.
+
+    One worker does the work under a lock shared through VERSIONS_DIR; the others
+    find it published when they get the lock. Returns the new state, if any.
+    """
+    if data_version() == published_version():
+        return None
+    with build_lock(VERSIONS_DIR):
+        if data_version() == published_version():
+            return None
+        state = prepare_state(rebuild_cube=True)
+        _warm(state)
+        publish_version(state.version)
+        return state
+
+
+def _watch(interval: float) -> None:
+    global _state
+    while True:
+        time.sleep(interval)
+        try:
+            state = _publish_new_data()
+            published = published_version()
+            if state is None and published is not None and published != _state.version:
+                # Another worker published it: prepare and warm our own copy before serving it
+                state = prepare_state(version=published)
+                _warm(state)
+            elif state is None and _state.files.cube is None and cube_version() == _state.version:
+                # A cube was built for the served version since it was staged
+                state = prepare_state(version=_state.version)
+            if state is not None:
+                with _state_lock:
+                    _state = state
+                logger.info("Swapped in data version %s", state.version)
+        except Exception:
+            # Files mid-copy or a failed build: keep serving the old state, retry next tick
+            logger.exception("Data reload failed; still serving %s", served_version())
+
+
+def is_ready() -> bool:
+    """Return True once the startup warm-up has finished, successfully or not."""
+    return _ready.is_set()
+
+
+def warmup_failed() -> bool:
+    """Return True if the startup warm-up raised, leaving the cache (partly) cold."""
+    return _warmup_failed
+
+
+def start_warmup() -> None:
+    """Run the registered warmers for the served state in a background thread."""
+    def run():
+        global _warmup_failed
+        try:
+            _warm(current_state())
+        except Exception:
+            # A cold cache is slower, not broken: serve anyway, but report it degraded
+            _warmup_failed = True
+            logger.exception("Startup warm-up failed")
+        finally:
+            _ready.set()
+
+    threading.Thread(target=run, name='nadac-warmup', daemon=True).start()
+
+
+def start_watcher(interval: float = RELOAD_INTERVAL) -> None:
+    """Poll the base data every `interval` seconds in a daemon thread (0 disables).
+
+    Workers with a watcher serve the version published under VERSIONS_DIR, so the
+    first one to start publishes the data on disk unless a staged version is
+    already published.
+    """
+    global _watcher, _state
+    if interval <= 0 or _watcher is not None:
+        return
+    VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    with build_lock(VERSIONS_DIR):
+        published = published_version()
+        if published is None or not staged_source(published).exists():
+            publish_version(current_state().version)
+        elif current_state().version != published:
+            # Serve what the other workers serve from the start (startup is off the request path)
+            with _state_lock:
+                _state = prepare_state(version=published)
+    _watcher = threading.Thread(target=_watch, args=(interval,), name='nadac-data-watcher', daemon=True)
+    _watcher.start()
+
+
+serve_files(lambda: current_state().files)
+result_cache.version_provider = served_version
+result_cache.pin = _pin_served
@@ -0,0 +1,215 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, ContextManager
+
+from data_processing.source import data_version, version_tag
+from config import RESULT_CACHE_SIZE, RESULT_CACHE_DIR
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        # Another worker pruned it first; treat it as the oldest entry.
+        return 0.0
+
+
+class ResultCache:
+    """Bounded LRU cache for view results, scoped to the served data version.
+
+    Entries live in process memory; when `directory` is set they are also written
+    there as pickles so every worker sharing the directory can reuse them. Entries
+    for other data versions are dropped as soon as the served version changes.
+    """
+
+    def __init__(self, max_entries: int, directory: Path | None = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Returns the data version requests are served from; hot reload swaps this.
+        self.version_provider: Callable[[], dict] = data_version
+        # Pins the data a computation reads for its duration and yields that version
+        self.pin: Callable[[], ContextManager[dict]] = self._served
+        self._scoped: ContextVar[str | None] = ContextVar('result_cache_scope', default=None)
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._tag: str | None = None
+        self._lock = threading.Lock()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current entry count."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _sync_version(self) -> str:
+        tag = version_tag(self.version_provider())
+        if tag != self._tag:
+            self._tag = tag
+            for key in [key for key in self._entries if key[0] != tag]:
+                del self._entries[key]
+            self._prune_directory()
+        return tag
+
+    @contextmanager
+    def _served(self):
+        yield self.version_provider()
+
+    @contextmanager
+    def scope(self):
+        """Look up, compute and store entries under one data version for the duration of the block.
+
+        The data is pinned with `pin`, so a computation that straddles a reload reads
+        one version and stores its result under that version, never the new one.
+        """
+        if self._scoped.get() is not None:
+            yield
+            return
+        with self.pin() as version:
+            token = self._scoped.set(version_tag(version))
+            try:
+                yield
+            finally:
+                self._scoped.reset(token)
+
+    def _key_tag(self) -> str:
+        # Entries are keyed on the scope's version, else the served one (call under the lock)
+        served = self._sync_version()
+        return self._scoped.get() or served
+
+    def _path(self, key: tuple) -> Path:
+        tag, *rest = key
+        digest = hashlib.sha1(repr(tuple(rest)).encode()).hexdigest()
+        return self.directory / f"{tag}-{digest}.pkl"
+
+    def _prune_directory(self) -> None:
+        """Drop on-disk entries from older data versions and beyond the size bound."""
+        if self.directory is None or self._tag is None:
+            return
+        current_mtime = int(self._tag.split('-')[0])
+        files = []
+        for path in self.directory.glob('*.pkl'):
+            if path.name.startswith(f"{self._tag}-"):
+                files.append(path)
+            elif int(path.name.split('-')[0]) < current_mtime:
+                # Newer versions may be warming up in another worker; only drop older ones
+                path.unlink(missing_ok=True)
+        if len(files) > self.max_entries:
+            files.sort(key=_mtime)
+            for path in files[:len(files) - self.max_entries]:
+                path.unlink(missing_ok=True)
+                self.evictions += 1
+
+    def _read_disk(self, key: tuple) -> tuple[bool, Any]:
+        if self.directory is None:
+            return False, None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, value
+
+    def _write_disk(self, key: tuple, value: Any) -> None:
+        if self.directory is None:
+            return
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def get(self, key: tuple) -> tuple[bool, Any]:
+        """Return (found, value) for `key` under the served version, checking memory then disk."""
+        with self._lock:
+            key = (self._key_tag(), *key)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+
+        found, value = self._read_disk(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+                self._store(key, value)
+            else:
+                self.misses += 1
+        return found, value
+
+    def put(self, key: tuple, value: Any, version: dict | None = None) -> None:
+        """Store `value`; pass `version` to prepare entries for a version not yet served."""
+        with self._lock:
+            key = (version_tag(version) if version is not None else self._key_tag(), *key)
+            self._store(key, value)
+            served = key[0] == self._tag
+        self._write_disk(key, value)
+        if self.directory is not None and served:
+            with self._lock:
+                self._prune_directory()
+
+    def _store(self, key: tuple, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def warm(self, version: dict, func: Callable, *args) -> None:
+        """Compute a memoized `func(*args)` and store it for `version` ahead of serving it."""
+        original = getattr(func, '__wrapped__', func)
+        self.put((original.__qualname__, *args), original(*args), version=version)
+
+    def lookup(self, func: Callable, *args) -> tuple[bool, Any]:
+        """Return (found, value) for a memoized `func(*args)` without computing it."""
+        return self.get((func.__qualname__, *args))
+
+    def save(self, func: Callable, args: tuple, value: Any) -> None:
+        """Store `value` as the memoized `func(*args)`, computed some other way."""
+        self.put((func.__qualname__, *args), value)
+
+    def memoize(self, func: Callable) -> Callable:
+        """Cache `func` results keyed on its name and (hashable) positional arguments."""
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = (func.__qualname__, *args)
+            with self.scope():
+                found, value = self.get(key)
+                if found:
+                    return value
+                value = func(*args)
+                self.put(key, value)
+            return value
+        return wrapper
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, Path(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None)
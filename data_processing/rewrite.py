@@ -0,0 +1,170 @@
+import argparse
+import os
+from pathlib import Path
+
+import polars as pl
+from polars import col as c
+import pyarrow.parquet as pq
+from data_processing.source import is_partitioned, partition_path, scan_source, source_files
+from config import BASE_DATA
+
+SORT_KEYS = ['year', 'quarter', 'description', 'state']
+DEFAULT_ROW_GROUP_SIZE = 64_000
+
+
+def rewrite_sorted(source: Path, output: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """Rewrite `source` sorted by SORT_KEYS with statistics and dictionary-encoded strings.
+
+    Works one quarter at a time so memory is bounded by the largest quarter, and
+    replaces `output` atomically (so `output` may be `source`).
+    """
+    base = scan_source(source)
+    quarters = base.select(c.year, c.quarter).unique().sort(['year', 'quarter']).collect(engine='streaming')
+    schema = base.collect_schema()
+    string_columns = [name for name, dtype in schema.items() if dtype == pl.String]
+
+    tmp = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+    writer = None
+    try:
+        for year, quarter in quarters.iter_rows():
+            table = (
+                base
+                .filter(c.year == year, c.quarter == quarter)
+                .sort(SORT_KEYS)
+                .collect(engine='streaming')
+                .to_arrow()
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    tmp,
+                    table.schema,
+                    compression='zstd',
+                    use_dictionary=string_columns,
+                    write_statistics=True,
+                )
+            writer.write_table(table, row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp, output)
+
+
+def rewrite_partitioned(source: Path, output: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """Write `source` as a hive-partitioned directory, one sorted file per year=/quarter=.
+
+    Partition columns live in the path only; each file is replaced atomically.
+    """
+    base = scan_source(source)
+    quarters = base.select(c.year, c.quarter).unique().sort(['year', 'quarter']).collect(engine='streaming')
+
+    for year, quarter in quarters.iter_rows():
+        partition = partition_path(year, quarter, output)
+        partition.mkdir(parents=True, exist_ok=True)
+        write_quarter(base.filter(c.year == year, c.quarter == quarter), partition / 'data.parquet', row_group_size)
+
+
+def write_quarter(data: pl.LazyFrame, path: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """Write one quarter's rows to a partition file, sorted by description and state."""
+    table = (
+        data
+        .drop('year', 'quarter')
+        .sort(SORT_KEYS[2:])
+        .collect(engine='streaming')
+        .to_arrow()
+    )
+    string_columns = [field.name for field in table.schema if field.type in ('string', 'large_string')]
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(
+        table,
+        tmp,
+        row_group_size=row_group_size,
+        compression='zstd',
+        use_dictionary=string_columns,
+        write_statistics=True,
+    )
+    os.replace(tmp, path)
+
+
+def row_groups_skipped(path: Path, year: int | None = None, quarter: int | None = None,
+                       description: str | None = None) -> tuple[int, int]:
+    """Return (skippable, total) row groups for an equality filter, using min/max statistics."""
+    metadata = pq.ParquetFile(path).metadata
+    names = metadata.schema.names
+    predicates = {name: value for name, value in
+                  (('year', year), ('quarter', quarter), ('description', description)) if value is not None}
+
+    skipped = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for name, value in predicates.items():
+            stats = row_group.column(names.index(name)).statistics
+            if stats is not None and stats.has_min_max and not stats.min <= value <= stats.max:
+                skipped += 1
+                break
+    return skipped, metadata.num_row_groups
+
+
+def pruning_report(path: Path, year: int, quarter: int, description: str) -> dict[str, tuple[int, int]]:
+    """Return skippable/total row groups for the typical map and line chart query shapes."""
+    return {
+        'map (quarter)': row_groups_skipped(path, year, quarter),
+        'map (quarter + drug)': row_groups_skipped(path, year, quarter, description),
+        'line (drug)': row_groups_skipped(path, description=description),
+    }
+
+
+def _print_report(label: str, report: dict[str, tuple[int, int]]) -> None:
+    print(label)
+    for query, (skipped, total) in report.items():
+        print(f"  {query:<22} skips {skipped:>6,} of {total:>6,} row groups")
+
+
+def default_output(source: Path, partitioned: bool) -> Path:
+    """Return where to write `source` in the requested layout: in place when the layout is unchanged.
+
+    Converting between layouts writes next to the source instead, e.g.
+    data/heat_map.parquet <-> data/heat_map/.
+    """
+    if partitioned == is_partitioned(source):
+        return source
+    return source.with_suffix('') if partitioned else source.with_suffix('.parquet')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rewrite the base data sorted and row-group clustered for predicate pruning.")
+    parser.add_argument('--source', type=Path, default=BASE_DATA)
+    parser.add_argument('--output', type=Path, help="Default: the source when the layout is unchanged, else next to it")
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument('--drug', help="Drug description used for the pruning report (default: the most common one)")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="Write a hive-partitioned directory (year=/quarter=) to --output instead of one file")
+    args = parser.parse_args()
+
+    args.output = args.output or default_output(args.source, args.partitioned)
+    if args.output.exists() and args.output.is_dir() != args.partitioned:
+        parser.error(f"--output {args.output} is a {'directory' if args.output.is_dir() else 'file'}; "
+                     f"{'--partitioned writes a directory' if args.partitioned else 'pass --partitioned to write a directory'}")
+
+    if args.partitioned:
+        rewrite_partitioned(args.source, args.output, args.row_group_size)
+        print(f"Wrote {len(source_files(args.output)):,} quarter partitions to {args.output}")
+        return
+
+    # Report on the latest quarter and a representative drug, as the default view would query
+    base = scan_source(args.source)
+    year, quarter = base.select(c.year, c.quarter).sort(['year', 'quarter']).last().collect().row(0)
+    drug = args.drug or base.group_by(c.description).len().sort('len').last().collect()['description'][0]
+    print(f"Pruning report for {year} Q{quarter}, drug {drug!r}")
+
+    before = None if is_partitioned(args.source) else pruning_report(args.source, year, quarter, drug)
+    rewrite_sorted(args.source, args.output, args.row_group_size)
+    after = pruning_report(args.output, year, quarter, drug)
+
+    if before is not None:
+        _print_report(f"before ({args.source})", before)
+    _print_report(f"after ({args.output})", after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from collections import defaultdict
+from dataclasses import dataclass
+
+from data_processing.metadata import Metadata
+
+DEFAULT_LIMIT = 50
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    """One page of matches and the total number of matches for the query."""
+    matches: list[str]
+    total: int
+
+
+class DrugIndex:
+    """Trigram index over drug descriptions, built once per data version.
+
+    Queries of three or more characters intersect trigram postings and confirm the
+    substring; shorter ones scan. Matches at the start of the description rank
+    ahead of matches elsewhere, then alphabetically.
+    """
+
+    def __init__(self, metadata: Metadata):
+        brands, generics = set(metadata.brand_drugs) - {None}, set(metadata.generic_drugs) - {None}
+        self.descriptions = sorted(brands | generics, key=str.upper)
+        self.keys = [description.upper() for description in self.descriptions]
+        # A description sold both as a brand and as a generic is listed under both filters
+        self.is_brand = [description in brands for description in self.descriptions]
+        self.is_generic = [description in generics for description in self.descriptions]
+        postings = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            for trigram in _trigrams(key):
+                postings[trigram].append(i)
+        self.postings = dict(postings)
+
+    def _candidate_ids(self, key: str) -> list[int]:
+        if len(key) < 3:
+            # Too short for trigrams; a scan is cheap at this length and matches the client filter
+            return [i for i, k in enumerate(self.keys) if key in k]
+        postings = sorted((self.postings.get(t, []) for t in _trigrams(key)), key=len)
+        ids = set(postings[0])
+        for posting in postings[1:]:
+            ids.intersection_update(posting)
+        return sorted(i for i in ids if key in self.keys[i])
+
+    def search(self, query: str | None, is_brand: bool | None = None, limit: int = DEFAULT_LIMIT,
+               offset: int = 0) -> SearchResult:
+        """Return matches for `query` (case-insensitive), optionally only brand or generic drugs."""
+        key = (query or '').strip().upper()
+        ids = self._candidate_ids(key) if key else range(len(self.keys))
+        if is_brand is not None:
+            flags = self.is_brand if is_brand else self.is_generic
+            ids = [i for i in ids if flags[i]]
+        ranked = sorted(ids, key=lambda i: (not self.keys[i].startswith(key), i))
+        return SearchResult(
+            matches=[self.descriptions[i] for i in ranked[offset:offset + limit]],
+            total=len(ranked),
+        )
@@ -0,0 +1,64 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import polars as pl
+from data_processing.source import data_version, prune_versions
+from config import SHARED_IPC_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, workers may race to build (still atomic)
+    fcntl = None
+
+
+@contextmanager
+def build_lock(directory: Path):
+    """Hold an exclusive lock so one worker builds a snapshot while the rest wait."""
+    if fcntl is None:
+        yield
+        return
+    with open(directory / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def snapshot_path(kind: str, source: Path, directory: Path) -> Path:
+    """Return the IPC path for `kind` ('base' or 'cube'), versioned on `source`."""
+    version = data_version(source)
+    return directory / f"{kind}-{version['mtime_ns']}-{version['size']}.arrow"
+
+
+def ensure_snapshot(kind: str, source: Path, frame: Callable[[], pl.LazyFrame], directory: Path) -> Path:
+    """Materialize `frame()` (read from `source`) as an uncompressed Arrow IPC file once per version.
+
+    Uncompressed IPC is memory-mapped by `pl.scan_ipc`, so every worker shares the
+    same page-cache pages instead of holding its own copy. `frame` is only called
+    to build a missing snapshot. Once the new one is in place, snapshots of all but
+    the previous data version (still served until the swap) are removed.
+    """
+    path = snapshot_path(kind, source, directory)
+    if path.exists():
+        return path
+
+    directory.mkdir(parents=True, exist_ok=True)
+    with build_lock(directory):
+        if not path.exists():
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            frame().sink_ipc(tmp, compression='uncompressed')
+            os.replace(tmp, path)
+            prune_versions(list(directory.glob(f"{kind}-*.arrow")))
+    return path
+
+
+def shared_enabled() -> bool:
+    return SHARED_IPC_DIR is not None
+
+
+def scan_shared(kind: str, source: Path, frame: Callable[[], pl.LazyFrame]) -> pl.LazyFrame:
+    """Return a zero-copy LazyFrame over the shared snapshot of `frame()`."""
+    return pl.scan_ipc(ensure_snapshot(kind, source, frame, Path(SHARED_IPC_DIR)))
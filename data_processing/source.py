@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import polars as pl
+from config import BASE_DATA, VERSIONS_DIR
+
+PARTITION_PATTERN = re.compile(r'^year=(\d+)$'), re.compile(r'^quarter=(\d+)$')
+# Types of the year=/quarter= partition columns, which live in the path only
+PARTITION_SCHEMA = {'year': pl.Int32, 'quarter': pl.Int32}
+# Staged versions kept on disk: the served one plus its predecessor, which
+# in-flight requests and slower workers may still be reading
+KEEP_VERSIONS = 2
+PUBLISHED = 'current.json'
+
+
+@dataclass(frozen=True)
+class DataFiles:
+    """The files one version of the data is queried from: its base data and the cube built from it, if any."""
+    version: dict
+    source: Path
+    cube: Path | None = None
+
+
+def is_partitioned(source: Path = BASE_DATA) -> bool:
+    """Return True when `source` is a hive-partitioned (year=/quarter=) directory."""
+    return source.is_dir()
+
+
+def source_files(source: Path = BASE_DATA) -> list[Path]:
+    """Return every parquet file backing `source`."""
+    if is_partitioned(source):
+        return sorted(source.glob('year=*/quarter=*/*.parquet'))
+    return [source]
+
+
+def data_version(source: Path = BASE_DATA) -> dict:
+    """Return a cheap fingerprint (newest mtime and total size) of the base data."""
+    stats = [path.stat() for path in source_files(source)]
+    return {
+        'mtime_ns': max((stat.st_mtime_ns for stat in stats), default=0),
+        'size': sum(stat.st_size for stat in stats),
+    }
+
+
+def version_tag(version: dict) -> str:
+    return f"{version['mtime_ns']}-{version['size']}"
+
+
+def link_or_copy(path: Path, target: Path) -> None:
+    """Hard-link `path` to `target`, copying (with its mtime) across filesystems."""
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copy2(path, target)
+
+
+def prune_versions(paths: list[Path], keep: int = KEEP_VERSIONS) -> None:
+    """Delete all but the `keep` most recently written of `paths` (files or directories)."""
+    def written(path: Path) -> int:
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return 0
+
+    for path in sorted(paths, key=written, reverse=True)[keep:]:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            # Workers still mapping or reading the file keep it until they close it
+            path.unlink(missing_ok=True)
+
+
+def staged_source(version: dict, source: Path = BASE_DATA, directory: Path = VERSIONS_DIR) -> Path:
+    """Return where `stage_source` put `version` of `source`."""
+    return directory / version_tag(version) / source.name
+
+
+def stage_source(source: Path = BASE_DATA, directory: Path = VERSIONS_DIR) -> tuple[Path, dict]:
+    """Hard-link the files of `source` into a directory of their own, named for their version.
+
+    The tools that write base data replace files rather than rewrite them, so the
+    links keep serving this version however `source` changes later. Returns the
+    staged source and its version (the same data_version() as `source`).
+    """
+    tmp = directory / f".staging-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    staged = tmp / source.name
+    partitioned = is_partitioned(source)
+    for path in source_files(source):
+        target = staged / path.relative_to(source) if partitioned else staged
+        target.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(path, target)
+    # Fingerprint the links, not `source`, in case a file was replaced while linking
+    version = data_version(staged)
+
+    final = directory / version_tag(version)
+    try:
+        tmp.rename(final)
+    except OSError:
+        # Already staged (by us earlier or by another worker)
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.utime(final)
+    else:
+        prune_versions([path for path in directory.iterdir() if path.is_dir() and not path.name.startswith('.')])
+    return final / source.name, version
+
+
+def publish_version(version: dict, directory: Path = VERSIONS_DIR) -> None:
+    """Point every worker sharing `directory` at a staged `version`."""
+    path = directory / PUBLISHED
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(version))
+    os.replace(tmp, path)
+
+
+_published: tuple[tuple, dict | None] | None = None
+
+
+def published_version(directory: Path = VERSIONS_DIR) -> dict | None:
+    """Return the version every worker should serve, or None before one is published.
+
+    Checked on every request, so the file is only re-read when it is replaced.
+    """
+    global _published
+    path = directory / PUBLISHED
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    key = (path, stat.st_ino, stat.st_mtime_ns)
+    cached = _published
+    if cached is None or cached[0] != key:
+        cached = _published = (key, json.loads(path.read_text()))
+    return cached[1]
+
+
+def partition_path(year: int, quarter: int, source: Path = BASE_DATA) -> Path:
+    return source / f"year={year}" / f"quarter={quarter}"
+
+
+def partition_year_quarters(source: Path = BASE_DATA) -> list[tuple[int, int]]:
+    """Return sorted (year, quarter) pairs from the partition directory listing alone."""
+    year_pattern, quarter_pattern = PARTITION_PATTERN
+    pairs = []
+    for year_dir in source.iterdir():
+        year = year_pattern.match(year_dir.name)
+        if year is None or not year_dir.is_dir():
+            continue
+        for quarter_dir in year_dir.iterdir():
+            quarter = quarter_pattern.match(quarter_dir.name)
+            if quarter is not None and any(quarter_dir.glob('*.parquet')):
+                pairs.append((int(year.group(1)), int(quarter.group(1))))
+    return sorted(pairs)
+
+
+def scan_source(source: Path = BASE_DATA) -> pl.LazyFrame:
+    """Scan a single parquet file or a hive-partitioned directory."""
+    if is_partitioned(source):
+        return pl.scan_parquet(source / '**' / '*.parquet', hive_partitioning=True, hive_schema=PARTITION_SCHEMA)
+    return pl.scan_parquet(source)
+
+
+def scan_quarter(year: int, quarter: int, source: Path = BASE_DATA) -> pl.LazyFrame:
+    """Scan one quarter, opening only its partition when the source is partitioned."""
+    partition = partition_path(year, quarter, source)
+    if is_partitioned(source) and partition.is_dir():
+        return (
+            pl.scan_parquet(partition / '*.parquet')
+            .with_columns(pl.lit(value, dtype=PARTITION_SCHEMA[name]).alias(name)
+                          for name, value in (('year', year), ('quarter', quarter)))
+        )
+    return scan_source(source).filter(pl.col('year') == year, pl.col('quarter') == quarter)
@@ -1,58 +1,47 @@
 import plotly.express as px
 import plotly.graph_objects as go
-from typing import Any
+from datetime import datetime
+import math
+# Plotly imports pandas lazily on the first figure it validates, and threads racing
+# through that first import (warm-up, requests, background jobs) can see a partially
+# initialized module, so import it up front
+import pandas  # noqa: F401
 import polars as pl
-import pandas as pd
+from plotly.colors import make_colorscale
+from config import METRICS, CHANGE_METRICS
+
+# Hover columns in customdata order; templates index into them positionally.
+HEAT_MAP_HOVER_COLUMNS = ['units', 'rx_ct', 'total_amt', 'weighted_nadac_total',
+                          'payment_per_unit', 'markup_per_unit', 'markup_percentile',
+                          'payment_per_unit_percentile']
+# Series plotted (and called out) on the line chart
+LINE_CHART_COLUMNS = ['payment_per_unit', 'weighted_nadac_per_unit']
+LINE_CHART_HOVER_COLUMNS = ['units', 'rx_ct', 'total_amt', 'weighted_nadac_total', 'markup_per_unit']
 
 def _friendly_label(metric: str) -> str:
     """Turn snake_case metric into a human-friendly title."""
     return metric.replace('_', ' ').title()
 
 
-def create_heat_map(data: pl.LazyFrame, metric: str, color_friendly: bool = False) -> go.Figure:
-    """
-    Create a professional-looking US choropleth.
+def heat_map_title(metric_label: str, year_quarter: str) -> str:
+    return f"U.S. State Heat Map — {metric_label} vs NADAC for {year_quarter}"
 
-    - data: polars DataFrame or LazyFrame already collected (function will call .to_pandas()).
-    - metric: column name to color by (e.g. 'payment_per_unit' or 'markup_per_unit').
-    - title: optional figure title. If omitted, a sensible default is used.
-    """
-    metric = metric.replace(' ', '_').lower()
-    df = data.collect(engine='streaming').to_pandas()
-    label = _friendly_label(metric)
 
-    # Define hover data formatting for additional columns
-    hover_columns = ['units', 'rx_ct', 'total_amt', 'weighted_nadac_total', 
-                    'payment_per_unit', 'markup_per_unit', 'markup_percentile', 
-                    'payment_per_unit_percentile']
-    
-    # Create hover_data dict with appropriate formatting
-    hover_data = {}
-    for col in hover_columns:
-        if col in df.columns:
-            if col in ['units', 'rx_ct']:
-                hover_data[col] = ':,'  # Integer formatting with commas
-            elif col in ['total_amt', 'weighted_nadac_total']:
-                hover_data[col] = ':$,.0f'  # Currency with no decimals
-            elif col in ['payment_per_unit', 'markup_per_unit']:
-                hover_data[col] = ':$,.2f'  # Currency with 2 decimals
-            elif col in ['markup_percentile', 'payment_per_unit_percentile']:
-                hover_data[col] = ':.1%'  # Percentage formatting
-    
+def animated_heat_map_title(metric_label: str, first_year_quarter: str, last_year_quarter: str) -> str:
+    return f"U.S. State Heat Map — {metric_label} vs NADAC, {first_year_quarter} to {last_year_quarter}"
 
 
-    fig = px.choropleth(
-        df,
-        locations='state',
-        locationmode='USA-states',
-        color=metric,
-        scope='usa',
-        color_continuous_scale=px.colors.sequential.Cividis if color_friendly else px.colors.sequential.Viridis,
-        labels={metric: label},
-        hover_data=hover_data,
-    )
+def _colorscale(metric: str, color_friendly: bool) -> list:
+    """Return a sequential colorscale, or a diverging one centered on zero for change metrics."""
+    if metric in CHANGE_METRICS:
+        return px.colors.diverging.PuOr if color_friendly else px.colors.diverging.RdBu_r
+    return px.colors.sequential.Cividis if color_friendly else px.colors.sequential.Viridis
+
+
+def _heat_map_metric_style(metric: str, columns: list[str]) -> dict:
+    """Return hover template and colorbar settings for coloring the heat map by `metric`."""
+    label = _friendly_label(metric)
 
-    # Create comprehensive hover template with all the data
     # Determine format for the main metric based on type
     if 'percentile' in metric:
         main_metric_format = "{z:.1%}"
@@ -62,72 +51,147 @@ def create_heat_map(data: pl.LazyFrame, metric: str, color_friendly: bool = Fals
         main_metric_format = "{z:$,.2f}"
         colorbar_format = '$,.2f'
         colorbar_title = f"{label} (USD)"
-    
+
     hover_template = f"<b>%{{location}}</b><br>"
     hover_template += f"<b>{label}: %{main_metric_format}</b><br><br>"
-    
+
     # Add each hover column if it exists in the data
-    if 'units' in df.columns:
+    if 'units' in columns:
         hover_template += "Units: %{customdata[0]:,}<br>"
-    if 'rx_ct' in df.columns:
+    if 'rx_ct' in columns:
         hover_template += "Prescriptions: %{customdata[1]:,}<br>"
-    if 'total_amt' in df.columns:
+    if 'total_amt' in columns:
         hover_template += "Total Amount: %{customdata[2]:$,.0f}<br>"
-    if 'weighted_nadac_total' in df.columns:
+    if 'weighted_nadac_total' in columns:
         hover_template += "Weighted NADAC Total: %{customdata[3]:$,.0f}<br>"
-    if 'payment_per_unit' in df.columns:
+    if 'payment_per_unit' in columns:
         hover_template += "Payment/Unit: %{customdata[4]:$,.2f}<br>"
-    if 'markup_per_unit' in df.columns:
+    if 'markup_per_unit' in columns:
         hover_template += "Markup/Unit: %{customdata[5]:$,.2f}<br>"
-    if 'markup_percentile' in df.columns:
+    if 'markup_percentile' in columns:
         hover_template += "Markup Percentile: %{customdata[6]:.1%}<br>"
-    if 'payment_per_unit_percentile' in df.columns:
+    if 'payment_per_unit_percentile' in columns:
         hover_template += "Payment Percentile: %{customdata[7]:.1%}<br>"
-    
+
     hover_template += "<extra></extra>"
-    
-    # Prepare custom data array for hover template
-    customdata_cols = []
-    for col in ['units', 'rx_ct', 'total_amt', 'weighted_nadac_total', 
-                'payment_per_unit', 'markup_per_unit', 'markup_percentile', 
-                'payment_per_unit_percentile']:
-        if col in df.columns:
-            customdata_cols.append(df[col])
-
-    # Polished trace styling and hover info
-    fig.update_traces(
-        marker_line_width=0.5,
-        marker_line_color='white',
-        hovertemplate=hover_template,
-        customdata=list(zip(*customdata_cols)) if customdata_cols else None,
-    )    # Update colorbar using coloraxis method (more reliable)
-    if 'percentile' in metric:
-        fig.update_coloraxes(
-            colorbar_title_text=colorbar_title,
-            colorbar_thickness=12,
-            colorbar_len=0.6,
-            colorbar_ticks="outside",
-            colorbar_tickformat=".1%"
-        )
-    else:
-        fig.update_coloraxes(
-            colorbar_title_text=colorbar_title,
-            colorbar_thickness=12,
-            colorbar_len=0.6,
-            colorbar_ticks="outside",
-            colorbar_tickformat="$,.2f"
+
+    return {
+        'label': label,
+        'hovertemplate': hover_template,
+        'colorbar_title': colorbar_title,
+        'tickformat': colorbar_format,
+        # Changes are colored around zero so gains and drops read as opposite hues
+        'cmid': 0 if metric in CHANGE_METRICS else None,
+    }
+
+
+def _customdata(data: pl.DataFrame, columns: list[str]):
+    """Return the present hover columns as one 2-D float array (no per-row tuples)."""
+    present = [col for col in columns if col in data.columns]
+    if not present:
+        return None
+    return data.select(pl.col(present).cast(pl.Float64)).to_numpy()
+
+
+def heat_map_store(data: pl.DataFrame, year_quarter: str) -> dict:
+    """Return every METRICS and CHANGE_METRICS column plus its styling for client-side switching.
+
+    `data` must be the same frame passed to `create_heat_map` so `z` lines up with the locations.
+    """
+    metrics = {}
+    for metric in METRICS + CHANGE_METRICS:
+        style = _heat_map_metric_style(metric, data.columns)
+        metrics[metric] = {
+            **style,
+            'z': data[metric].to_list(),
+            'title': heat_map_title(style['label'], year_quarter),
+            'colorscales': {
+                'default': make_colorscale(_colorscale(metric, False)),
+                'friendly': make_colorscale(_colorscale(metric, True)),
+            },
+        }
+    return {
+        'year_quarter': year_quarter,
+        'metrics': metrics,
+    }
+
+
+def restyle_heat_map(figure: dict, store: dict, metric: str, color_friendly: bool = False) -> tuple[dict, str]:
+    """Recolor a serialized heat map by `metric` from its `heat_map_store`; returns (figure, title).
+
+    The server-side twin of `heat_map.restyle` in assets/heat_map.js, for figures
+    served as JSON without the data behind them.
+    """
+    style = store['metrics'][metric.replace(' ', '_').lower()]
+    layout = figure['layout']
+    coloraxis = {
+        **layout['coloraxis'],
+        'colorscale': style['colorscales']['friendly' if color_friendly else 'default'],
+        'colorbar': {
+            **layout['coloraxis'].get('colorbar', {}),
+            'title': {**layout['coloraxis'].get('colorbar', {}).get('title', {}), 'text': style['colorbar_title']},
+            'tickformat': style['tickformat'],
+        },
+    }
+    coloraxis.pop('cmid', None)
+    if style['cmid'] is not None:
+        coloraxis['cmid'] = style['cmid']
+    trace = {**figure['data'][0], 'z': style['z'], 'hovertemplate': style['hovertemplate']}
+    return {**figure, 'data': [trace, *figure['data'][1:]], 'layout': {**layout, 'coloraxis': coloraxis}}, style['title']
+
+
+def create_heat_map(data: pl.DataFrame | pl.LazyFrame, metric: str, color_friendly: bool = False) -> go.Figure:
+    """
+    Create a professional-looking US choropleth.
+
+    - data: polars DataFrame, or a LazyFrame the function will collect.
+    - metric: column name to color by (e.g. 'payment_per_unit' or 'markup_per_unit').
+
+    Builds the `go.Choropleth` trace directly from NumPy columns; no pandas round-trip.
+    """
+    metric = metric.replace(' ', '_').lower()
+    if isinstance(data, pl.LazyFrame):
+        data = data.collect(engine='streaming')
+    style = _heat_map_metric_style(metric, data.columns)
+
+    fig = go.Figure(
+        go.Choropleth(
+            locations=data['state'].to_numpy(),
+            locationmode='USA-states',
+            z=data[metric].cast(pl.Float64).to_numpy(),
+            coloraxis='coloraxis',
+            customdata=_customdata(data, HEAT_MAP_HOVER_COLUMNS),
+            hovertemplate=style['hovertemplate'],
+            marker_line_width=0.5,
+            marker_line_color='white',
         )
+    )
+    _style_heat_map(fig, metric, style, color_friendly, cmid=style['cmid'])
+    return fig
 
-    # Layout improvements
+
+def _style_heat_map(fig: go.Figure, metric: str, style: dict, color_friendly: bool, **coloraxis) -> None:
+    """Apply the shared coloraxis, layout and geo styling to a heat map figure."""
+    # Colorbar lives on the shared coloraxis so assets/heat_map.js can restyle it
     fig.update_layout(
-        # title_text="US by state",
-        # title_x=0.5,
+        coloraxis=dict(
+            **coloraxis,
+            colorscale=_colorscale(metric, color_friendly),
+            colorbar=dict(
+                title_text=style['colorbar_title'],
+                thickness=12,
+                len=0.6,
+                ticks="outside",
+                tickformat=style['tickformat'],
+            ),
+        ),
         template='plotly_white',
         margin=dict(l=10, r=10, t=50, b=10),
     )
 
     # Geo styling: subtle lake color and bounded view
     fig.update_geos(
+        scope='usa',
         visible=False,
         showcountries=True,
         showsubunits=True,
@@ -135,54 +199,99 @@ def create_heat_map(data: pl.LazyFrame, metric: str, color_friendly: bool = Fals
     )
 
 
+def create_animated_heat_map(data: pl.DataFrame | pl.LazyFrame, metric: str, color_friendly: bool = False) -> go.Figure:
+    """Create a US choropleth with one animation frame per quarter.
+
+    - data: every quarter's state rows (see `filter_map_frames`) with a `year_quarter` column, sorted by quarter.
+    - metric: column name to color by.
+
+    The color range is fixed to the metric's range over all quarters so frames are
+    comparable; the slider and play button scrub frames in the browser with no callbacks.
+    The figure opens on the latest quarter.
+    """
+    metric = metric.replace(' ', '_').lower()
+    if isinstance(data, pl.LazyFrame):
+        data = data.collect(engine='streaming')
+    style = _heat_map_metric_style(metric, data.columns)
+    quarters = data['year_quarter'].unique(maintain_order=True).to_list()
+
+    frames = []
+    for year_quarter, quarter in zip(quarters, data.partition_by('year_quarter', maintain_order=True)):
+        frames.append(go.Frame(
+            name=year_quarter,
+            data=[go.Choropleth(
+                locations=quarter['state'].to_numpy(),
+                z=quarter[metric].cast(pl.Float64).to_numpy(),
+                customdata=_customdata(quarter, HEAT_MAP_HOVER_COLUMNS),
+            )],
+        ))
+
+    latest = frames[-1].data[0] if frames else go.Choropleth()
+    fig = go.Figure(
+        go.Choropleth(
+            locations=latest.locations,
+            locationmode='USA-states',
+            z=latest.z,
+            coloraxis='coloraxis',
+            customdata=latest.customdata,
+            hovertemplate=style['hovertemplate'],
+            marker_line_width=0.5,
+            marker_line_color='white',
+        ),
+        frames=frames,
+    )
+    if style['cmid'] is not None:
+        # Symmetric around zero so the diverging scale's midpoint means "no change"
+        bound = data[metric].abs().max()
+        _style_heat_map(fig, metric, style, color_friendly, cmin=-bound if bound else None, cmax=bound)
+    else:
+        _style_heat_map(fig, metric, style, color_friendly, cmin=data[metric].min(), cmax=data[metric].max())
+
+    frame_args = dict(frame=dict(duration=600, redraw=True), transition=dict(duration=0), mode='immediate')
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=50, b=70),
+        sliders=[dict(
+            active=max(len(quarters) - 1, 0),
+            currentvalue=dict(prefix='Quarter: '),
+            pad=dict(t=30),
+            steps=[dict(label=yq, method='animate', args=[[yq], frame_args]) for yq in quarters],
+        )],
+        updatemenus=[dict(
+            type='buttons',
+            direction='left',
+            x=0,
+            y=0,
+            xanchor='right',
+            yanchor='top',
+            pad=dict(t=30, r=10),
+            showactive=False,
+            buttons=[
+                dict(label='Play', method='animate', args=[None, frame_args]),
+                dict(label='Pause', method='animate', args=[[None], dict(frame_args, frame=dict(duration=0, redraw=False))]),
+            ],
+        )],
+    )
+
     return fig
 
 
-def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figure:
+def create_line_chart(data: pl.DataFrame | pl.LazyFrame, selected_year_quarter: str | None = None) -> go.Figure:
     """Create a polished time series comparing payment_per_unit and weighted_nadac_per_unit.
 
-    - data: a pandas DataFrame (from Polars .collect()) with columns `date`,
+    - data: polars DataFrame (or LazyFrame, collected here) with columns `date`,
       `payment_per_unit`, and `weighted_nadac_per_unit`.
     - selected_year_quarter: optional year_quarter string to highlight specific period
     """
-    data = data.collect(engine='streaming').to_pandas()
-    y_cols = ['payment_per_unit', 'weighted_nadac_per_unit']
+    if isinstance(data, pl.LazyFrame):
+        data = data.collect(engine='streaming')
+    y_cols = LINE_CHART_COLUMNS
     labels = {c: _friendly_label(c) for c in y_cols}
-
-    # Additional hover data columns if available
-    hover_columns = ['units', 'rx_ct', 'total_amt', 'weighted_nadac_total', 'markup_per_unit']
-    hover_data = {}
-    for col in hover_columns:
-        if col in data.columns:
-            if col in ['units', 'rx_ct']:
-                hover_data[col] = ':,'  # Integer formatting with commas
-            elif col in ['total_amt', 'weighted_nadac_total']:
-                hover_data[col] = ':$,.0f'  # Currency with no decimals
-            else:
-                hover_data[col] = ':$,.2f'  # Currency with 2 decimals
-
-    fig = px.line(
-        data,
-        x='date',
-        y=y_cols,
-        markers=True,
-        labels={**labels, 'date': 'Date'},
-        color_discrete_sequence=px.colors.qualitative.Set2,  # Professional color palette
-        hover_data=hover_data,
-    )
-
-    # Ensure legend uses friendly labels (px may keep original column names as trace names)
-    for trace in fig.data:
-        orig = getattr(trace, 'name', None)
-        if orig in labels:
-            friendly = labels[orig]
-            t: Any = trace
-            t.update(name=friendly, legendgroup=friendly)
+    colors = px.colors.qualitative.Set2  # Professional color palette
 
     # Create comprehensive hover template similar to heat map
     hover_template = "<b>%{x|%b %Y}</b><br>"
     hover_template += "<b>%{fullData.name}: %{y:$,.2f}</b><br><br>"
-    
+
     # Add additional data if available
     if 'units' in data.columns:
         hover_template += "Units: %{customdata[0]:,}<br>"
@@ -194,14 +303,27 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
         hover_template += "Weighted NADAC Total: %{customdata[3]:$,.0f}<br>"
     if 'markup_per_unit' in data.columns:
         hover_template += "Markup/Unit: %{customdata[4]:$,.2f}<br>"
-    
+
     hover_template += "<extra></extra>"
 
-    # Prepare custom data array for hover template
-    customdata_cols = []
-    for col in hover_columns:
-        if col in data.columns:
-            customdata_cols.append(data[col])
+    dates = data['date'].to_numpy()
+    customdata = _customdata(data, LINE_CHART_HOVER_COLUMNS)
+
+    # Enhanced trace styling and hover formatting
+    fig = go.Figure([
+        go.Scatter(
+            x=dates,
+            y=data[col].cast(pl.Float64).to_numpy(),
+            name=labels[col],
+            legendgroup=labels[col],
+            mode='lines+markers',
+            marker=dict(size=8, color=colors[i % len(colors)], line=dict(width=1, color='white')),
+            line=dict(width=3, color=colors[i % len(colors)]),
+            customdata=customdata,
+            hovertemplate=hover_template,
+        )
+        for i, col in enumerate(y_cols)
+    ])
 
     # General layout with professional styling
     fig.update_layout(
@@ -222,14 +344,6 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
         paper_bgcolor='white',
     )
 
-    # Enhanced trace styling and hover formatting
-    fig.update_traces(
-        marker=dict(size=8, line=dict(width=1, color='white')), 
-        line=dict(width=3),
-        hovertemplate=hover_template,
-        customdata=list(zip(*customdata_cols)) if customdata_cols else None,
-    )
-
     # Professional axis formatting matching heat map style
     fig.update_xaxes(
         showgrid=True,
@@ -239,6 +353,7 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
         ticks='outside',
         tickfont_size=12,
         title_font_size=14,
+        title_text='Date',
         linecolor='LightGray',
         mirror=True
     )
@@ -273,7 +388,15 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
         )
     )
 
-    # Add annotations for selected period or latest values
+    for annotation in line_chart_annotations(data, selected_year_quarter):
+        fig.add_annotation(**annotation)
+
+    return fig
+
+
+def line_chart_annotations(data: pl.DataFrame, selected_year_quarter: str | None = None) -> list[dict]:
+    """Return the line chart's callouts for the selected period (or the latest values), as annotation properties."""
+    annotations = []
     if len(data) > 0:
         # Convert selected year_quarter to date for annotation
         if selected_year_quarter:
@@ -286,32 +409,28 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
                 # Create target date for the quarter (using first month of quarter)
                 quarter_month_map = {1: 1, 2: 4, 3: 7, 4: 10}
                 target_month = quarter_month_map.get(quarter, 1)
-                target_date = pd.Timestamp(year=year, month=target_month, day=1)
+                target_date = datetime(year, target_month, 1)
                 
                 # Find the closest date in the data to the target
-                data['date_diff'] = abs(data['date'] - target_date)
-                selected_data = data.loc[data['date_diff'].idxmin()]
-                annotation_date = selected_data['date']
-                
-                # Clean up temporary column
-                data = data.drop('date_diff', axis=1)
+                row = (data['date'] - target_date).abs().arg_min()
                 
             except (ValueError, KeyError):
                 # Fallback to latest date if parsing fails
-                annotation_date = data['date'].max()
-                selected_data = data[data['date'] == annotation_date].iloc[0]
+                row = data['date'].arg_max()
         else:
             # Use latest date if no year_quarter selected
-            annotation_date = data['date'].max()
-            selected_data = data[data['date'] == annotation_date].iloc[0]
+            row = data['date'].arg_max()
+
+        selected_data = data.row(row, named=True)
+        annotation_date = selected_data['date']
         
         # Define colors for annotations
         annotation_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
         
-        for i, col in enumerate(y_cols):
+        for i, col in enumerate(LINE_CHART_COLUMNS):
             if col in data.columns:
-                annotation_value = selected_data[col] if hasattr(selected_data, col) else selected_data.get(col)
-                if annotation_value is not None and not pd.isna(annotation_value):
+                annotation_value = selected_data.get(col)
+                if annotation_value is not None and not math.isnan(annotation_value):
                     color = annotation_colors[i % len(annotation_colors)]
                     
                     # Add annotation text with period info
@@ -320,7 +439,7 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
                     else:
                         annotation_text = f"Latest<br>${annotation_value:,.2f}"
                     
-                    fig.add_annotation(
+                    annotations.append(dict(
                         x=annotation_date,
                         y=annotation_value,
                         text=annotation_text,
@@ -335,6 +454,6 @@ def create_line_chart(data, selected_year_quarter: str | None = None) -> go.Figu
                         font=dict(size=10, color=color),
                         ax=20,
                         ay=-30
-                    )
+                    ))
 
-    return fig
\ No newline at end of file
+    return annotations
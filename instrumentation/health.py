@@ -0,0 +1,15 @@
+from flask import Flask, jsonify
+from data_processing.reload import is_ready, served_version, warmup_failed
+
+
+def register_health_endpoint(server: Flask, path: str = '/health') -> None:
+    """Serve readiness: 503 while the startup warm-up runs, 200 once it is done.
+
+    The status is "degraded" rather than "ready" if the warm-up failed: requests
+    are served, but from a cold cache.
+    """
+    @server.route(path)
+    def health():
+        if not is_ready():
+            return jsonify(status='warming'), 503
+        return jsonify(status='degraded' if warmup_failed() else 'ready', data_version=served_version())
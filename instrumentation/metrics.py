@@ -0,0 +1,128 @@
+import os
+import resource
+import threading
+
+from flask import Flask, Response
+from data_processing.reload import served_version
+from data_processing.result_cache import result_cache
+from instrumentation.timing import Histogram, histograms
+
+# Base data rows behind each query (counted in raw scans, summed from the cube's
+# stored counts), from thousands for one drug to millions for every drug.
+ROW_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+QUANTILES = (0.5, 0.9, 0.99)
+
+_rows: dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def record_rows(query: str, rows: int) -> None:
+    """Record how many source rows a query aggregated."""
+    with _lock:
+        histogram = _rows.get(query)
+        if histogram is None:
+            histogram = _rows[query] = Histogram(ROW_BUCKETS)
+        histogram.observe(rows)
+
+
+def process_rss_bytes() -> int:
+    """Return current resident set size, falling back to peak RSS off Linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _labels(**labels) -> str:
+    # Every worker process keeps its own counters; the label keeps their series apart
+    labels = {'worker': os.getpid(), **labels}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+
+    stage_histograms = histograms()
+    lines += [
+        "# HELP nadac_callback_requests_total Timed Dash callback invocations.",
+        "# TYPE nadac_callback_requests_total counter",
+    ]
+    for (callback, stage_name), histogram in sorted(stage_histograms.items()):
+        if stage_name == 'callback':
+            lines.append(f"nadac_callback_requests_total{_labels(callback=callback)} {histogram.count}")
+
+    lines += [
+        "# HELP nadac_callback_stage_seconds Callback stage latency (query, figure, encode, total).",
+        "# TYPE nadac_callback_stage_seconds histogram",
+    ]
+    for (callback, stage_name), histogram in sorted(stage_histograms.items()):
+        lines += _histogram_lines('nadac_callback_stage_seconds', histogram, callback=callback, stage=stage_name)
+
+    lines += [
+        "# HELP nadac_callback_latency_seconds Approximate end-to-end callback latency percentiles.",
+        "# TYPE nadac_callback_latency_seconds gauge",
+    ]
+    for (callback, stage_name), histogram in sorted(stage_histograms.items()):
+        if stage_name == 'total':
+            for q in QUANTILES:
+                lines.append(f"nadac_callback_latency_seconds{_labels(callback=callback, quantile=q)} {histogram.quantile(q)}")
+
+    stats = result_cache.stats()
+    lines += [
+        "# HELP nadac_result_cache_hits_total Result cache hits.",
+        "# TYPE nadac_result_cache_hits_total counter",
+        f"nadac_result_cache_hits_total{_labels()} {stats['hits']}",
+        "# HELP nadac_result_cache_misses_total Result cache misses.",
+        "# TYPE nadac_result_cache_misses_total counter",
+        f"nadac_result_cache_misses_total{_labels()} {stats['misses']}",
+        "# HELP nadac_result_cache_evictions_total Result cache evictions.",
+        "# TYPE nadac_result_cache_evictions_total counter",
+        f"nadac_result_cache_evictions_total{_labels()} {stats['evictions']}",
+        "# HELP nadac_result_cache_hit_ratio Result cache hits / lookups since start.",
+        "# TYPE nadac_result_cache_hit_ratio gauge",
+        f"nadac_result_cache_hit_ratio{_labels()} {stats['hit_rate']}",
+        "# HELP nadac_result_cache_entries Entries held in this process.",
+        "# TYPE nadac_result_cache_entries gauge",
+        f"nadac_result_cache_entries{_labels()} {stats['entries']}",
+    ]
+
+    with _lock:
+        rows = dict(_rows)
+    lines += [
+        "# HELP nadac_query_rows_scanned Source rows aggregated per query.",
+        "# TYPE nadac_query_rows_scanned histogram",
+    ]
+    for query, histogram in sorted(rows.items()):
+        lines += _histogram_lines('nadac_query_rows_scanned', histogram, query=query)
+
+    version = served_version()
+    lines += [
+        "# HELP nadac_process_resident_memory_bytes Resident set size of this worker.",
+        "# TYPE nadac_process_resident_memory_bytes gauge",
+        f"nadac_process_resident_memory_bytes{_labels()} {process_rss_bytes()}",
+        "# HELP nadac_data_version_info Base data version served by this worker.",
+        "# TYPE nadac_data_version_info gauge",
+        f"nadac_data_version_info{_labels(mtime_ns=version['mtime_ns'], size=version['size'])} 1",
+    ]
+
+    return '\n'.join(lines) + '\n'
+
+
+def register_metrics_endpoint(server: Flask, path: str = '/metrics') -> None:
+    @server.route(path)
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,138 @@
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+from flask import Flask, g, has_request_context, request
+from config import TIMING_ENABLED
+
+logger = logging.getLogger('nadac.timing')
+if TIMING_ENABLED and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Latency buckets in seconds (upper bounds), Prometheus style.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with approximate quantiles."""
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the q-th observation."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+_histograms: dict[tuple[str, str], Histogram] = {}
+_lock = threading.Lock()
+_stages: ContextVar[dict | None] = ContextVar('timing_stages', default=None)
+
+
+def observe(callback: str, stage_name: str, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.get((callback, stage_name))
+        if histogram is None:
+            histogram = _histograms[(callback, stage_name)] = Histogram()
+        histogram.observe(seconds)
+
+
+def histograms() -> dict[tuple[str, str], Histogram]:
+    """Return a snapshot of the (callback, stage) histograms."""
+    with _lock:
+        return dict(_histograms)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage (query, figure, ...) of the callback currently being timed."""
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def _emit(callback: str, stages: dict[str, float]) -> None:
+    for name, seconds in stages.items():
+        observe(callback, name, seconds)
+    if TIMING_ENABLED:
+        logger.info(json.dumps({
+            'event': 'callback_timing',
+            'callback': callback,
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in stages.items()},
+        }))
+
+
+def timed_callback(name: str) -> Callable:
+    """Record stage timings for a Dash callback; NADAC_TIMING also logs each one.
+
+    Inside a request recording is deferred to `after_request` so it can include
+    the response encoding time. Elsewhere (background jobs) the total is the
+    callback time.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stages: dict[str, float] = {}
+            token = _stages.set(stages)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stages['callback'] = time.perf_counter() - start
+                _stages.reset(token)
+                if has_request_context():
+                    g.timed_callback = (name, stages)
+                else:
+                    stages['total'] = stages['callback']
+                    _emit(name, stages)
+        return wrapper
+    return decorator
+
+
+def register_request_timing(server: Flask) -> None:
+    """Attribute Dash response encoding time (request total minus callback) to timed callbacks."""
+    @server.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def _finish_timer(response):
+        timed = g.pop('timed_callback', None)
+        if timed is not None and 'request_start' in g:
+            name, stages = timed
+            stages['total'] = time.perf_counter() - g.request_start
+            stages['encode'] = max(stages['total'] - stages['callback'], 0.0)
+            _emit(name, stages)
+        return response
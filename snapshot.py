@@ -0,0 +1,312 @@
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from itertools import product
+from pathlib import Path
+from typing import Callable
+
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+from data_processing.data_processing import filter_map_data, filter_map_frames, filter_line_data, top_drugs, year_quarter_list
+from data_processing.filters import BRAND_VALUES, UTILIZATION_VALUES, FilterSpec
+from data_processing.metadata import Metadata
+from data_processing.reload import DataState, current_state, prepare_state, serving
+from data_processing.search import DrugIndex
+from data_processing.source import prune_versions, publish_version, published_version, version_tag
+from figures.figures import line_chart_annotations, restyle_heat_map
+from views import _map_result, _line_result, _animated_map_result
+from config import METRIC_DROPDOWN_LABELS, STATIC_BUNDLE
+
+MANIFEST = 'manifest.json'
+VIEWS = 'views'
+UNAVAILABLE = "This view is not included in the static snapshot"
+
+
+def entry_name(kind: str, *args) -> str:
+    """Return the bundle file name of one view: the SHA-1 of its key as compact, sorted JSON.
+
+    Keys are [kind, *args] with a FilterSpec written as its field dict, e.g.
+    ["map","2024 Q1",{"drug":null,"is_brand":true,"is_ffsu":null}], so a client
+    fetching the bundle from a CDN can compute them too.
+    """
+    key = json.dumps([kind, *(asdict(arg) if isinstance(arg, FilterSpec) else arg for arg in args)],
+                     sort_keys=True, separators=(',', ':'))
+    return f"{hashlib.sha1(key.encode()).hexdigest()}.json.gz"
+
+
+def _write(directory: Path, name: str, entry: dict) -> int:
+    # mtime=0 keeps rebuilt files byte-identical, so unchanged views keep their CDN cache
+    data = gzip.compress(to_json_plotly(entry).encode(), mtime=0)
+    (directory / VIEWS / name).write_bytes(data)
+    return len(data)
+
+
+_worker_state: DataState | None = None
+
+
+def _data_state(version: dict) -> DataState:
+    # Each worker process prepares the staged version the bundle is built from once
+    global _worker_state
+    if _worker_state is None or _worker_state.version != version:
+        _worker_state = prepare_state(version=version)
+    return _worker_state
+
+
+def build_views(directory: Path, version: dict, filters: FilterSpec, quarters: list[str],
+                states: list[str | None], animated: bool) -> tuple[int, int]:
+    """Write every map (per quarter) and line chart (per state) view for one filter combination.
+
+    Runs in a worker process, querying data `version` whatever is on disk by then;
+    returns the number of views and bytes written.
+    """
+    with serving(_data_state(version)):
+        return _build_views(directory, filters, quarters, states, animated)
+
+
+def _build_views(directory: Path, filters: FilterSpec, quarters: list[str], states: list[str | None],
+                 animated: bool) -> tuple[int, int]:
+    sizes = []
+    for year_quarter in quarters:
+        data = filter_map_data(year_quarter, filters).collect(engine='streaming')
+        figure, store = _map_result(data, year_quarter)
+        sizes.append(_write(directory, entry_name('map', year_quarter, filters),
+                            {'figure': figure, 'store': store, 'data': data.to_dict(as_series=False)}))
+
+    for state in states:
+        data = filter_line_data(state, filters).collect(engine='streaming')
+        fig, title = _line_result(data, state, None)
+        # The callouts follow the selected quarter; the rest of the figure does not
+        annotations = {year_quarter or '': [go.layout.Annotation(annotation).to_plotly_json()
+                                            for annotation in line_chart_annotations(data, year_quarter)]
+                       for year_quarter in [None, *quarters]}
+        fig.layout.annotations = ()
+        sizes.append(_write(directory, entry_name('line', state, filters),
+                            {'figure': fig.to_dict(), 'title': title, 'annotations': annotations,
+                             'data': data.to_dict(as_series=False)}))
+
+    if animated:
+        data = filter_map_frames(filters).collect(engine='streaming')
+        for metric, color_blind_mode in product(METRIC_DROPDOWN_LABELS, (False, True)):
+            fig, title = _animated_map_result(data, metric, color_blind_mode)
+            sizes.append(_write(directory, entry_name('animated', filters, metric, color_blind_mode),
+                                {'figure': fig.to_dict(), 'title': title}))
+    return len(sizes), sum(sizes)
+
+
+def build_bundle(output: Path, quarters: list[str] | None = None, drugs: list[str] | None = None,
+                 states: list[str] | None = None, brands: list[str] | None = None,
+                 utilizations: list[str] | None = None, animated: bool = False,
+                 workers: int | None = None) -> dict:
+    """Precompute the views for quarters x brand x utilization x drugs x states into `output`.
+
+    Each argument narrows one dimension (default: all of it; drugs default to
+    every drug); quarters, states or drugs missing from the data raise ValueError. The
+    all-drugs and all-states views are always included. Filter combinations are
+    spread over a pool of `workers` processes, all querying the data version
+    served when the build starts.
+
+    Each build is written to a directory of its own under `output`, and
+    `output`/current.json is pointed at it once complete, so readers never mix
+    the views and manifest of two builds. Returns the manifest.
+    """
+    served = current_state()
+    metadata = served.metadata
+    quarters = _known('Quarters', quarters, year_quarter_list())
+    states = _known('States', states, [state for state in metadata.states if state is not None])
+    # An empty drug list (--top-drugs 0) bundles only the all-drugs views
+    drugs = _known('Drugs', drugs, sorted({*metadata.brand_drugs, *metadata.generic_drugs} - {None})) if drugs != [] else []
+    filters = [
+        FilterSpec.from_values(drug, brand, utilization)
+        for drug, brand, utilization in product([None, *drugs], brands or ['all', 'brand', 'generic'],
+                                                utilizations or ['all', 'ffsu', 'mcou'])
+    ]
+
+    tmp = output / f".building-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    (tmp / VIEWS).mkdir(parents=True)
+    entries = size = 0
+    try:
+        # Spawned workers: a forked child deadlocks in Polars once the parent has run a query
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(build_views, tmp, served.version, spec, quarters, [None, *states], animated)
+                       for spec in filters]
+            for future in as_completed(futures):
+                count, written = future.result()
+                entries += count
+                size += written
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    brand_drugs, generic_drugs = set(metadata.brand_drugs), set(metadata.generic_drugs)
+    manifest = {
+        'data_version': served.version,
+        'quarters': quarters,
+        'states': states,
+        'brand_drugs': [drug for drug in drugs if drug in brand_drugs],
+        'generic_drugs': [drug for drug in drugs if drug in generic_drugs],
+        'filters': [asdict(spec) for spec in filters],
+        'metrics': METRIC_DROPDOWN_LABELS,
+        'animated': animated,
+        'entries': entries,
+        'bytes': size,
+    }
+    (tmp / MANIFEST).write_text(json.dumps(manifest, indent=1))
+
+    name = f"{version_tag(served.version)}-{time.time_ns()}"
+    tmp.rename(output / name)
+    publish_version({'bundle': name}, output)
+    # The previous build stays for readers that resolved the pointer before the swap
+    prune_versions([path for path in output.iterdir() if path.is_dir() and not path.name.startswith('.')])
+    return manifest
+
+
+def _known(kind: str, selected: list[str] | None, available: list[str]) -> list[str]:
+    # The selection in data order (chronological for quarters), or everything by default
+    if not selected:
+        return available
+    unknown = sorted(set(selected) - set(available))
+    if unknown:
+        raise ValueError(f"{kind} not in the data: {', '.join(unknown)}")
+    return [value for value in available if value in set(selected)]
+
+
+class StaticBundle:
+    """Serve the map and line chart views from the bundles `build_bundle` publishes under `root`.
+
+    The view methods take the same arguments as their namesakes in `views` and
+    return figures as JSON-ready dicts, so serving never queries the data. Views
+    outside the bundle come back empty, titled UNAVAILABLE. Reads follow
+    `root`/current.json, so a rebuilt bundle is served once it is published.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._current: tuple[str, Path, dict] | None = None
+        self._lock = threading.Lock()
+        self._swap_callbacks: list[Callable[[DataState], None]] = []
+        self._bundle()
+
+    def _bundle(self) -> tuple[Path, dict]:
+        """Return the directory and manifest of the published bundle, loading them after a swap."""
+        published = published_version(self.root)
+        if published is None:
+            raise FileNotFoundError(f"No bundle published under {self.root}; run `python -m snapshot`")
+        current = self._current
+        if current is None or current[0] != published['bundle']:
+            with self._lock:
+                if self._current is None or self._current[0] != published['bundle']:
+                    directory = self.root / published['bundle']
+                    manifest = json.loads((directory / MANIFEST).read_text())
+                    self._current = (published['bundle'], directory, manifest)
+                    for callback in self._swap_callbacks:
+                        callback(self._state(manifest))
+                current = self._current
+        return current[1], current[2]
+
+    @property
+    def manifest(self) -> dict:
+        return self._bundle()[1]
+
+    def refresh(self) -> None:
+        """Load the published bundle if it changed, calling the `on_swap` callbacks."""
+        self._bundle()
+
+    def on_swap(self, callback: Callable[[DataState], None]) -> None:
+        """Call `callback` with the bundle's data state now and whenever a new bundle is published."""
+        self._swap_callbacks.append(callback)
+        callback(self.state())
+
+    def state(self) -> DataState:
+        """Return the data state to serve: the bundle's data version and filter domains."""
+        return self._state(self.manifest)
+
+    @staticmethod
+    def _state(manifest: dict) -> DataState:
+        metadata = Metadata(
+            year_quarters=manifest['quarters'],
+            states=manifest['states'],
+            brand_drugs=manifest['brand_drugs'],
+            generic_drugs=manifest['generic_drugs'],
+        )
+        return DataState(version=manifest['data_version'], metadata=metadata, drug_index=DrugIndex(metadata))
+
+    def _read(self, kind: str, *args) -> dict | None:
+        directory, _ = self._bundle()
+        try:
+            with gzip.open(directory / VIEWS / entry_name(kind, *args)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def map_view(self, year_quarter: str, filters: FilterSpec, metric: str,
+                 color_blind_mode: bool) -> tuple[dict, str, dict | None]:
+        entry = self._read('map', year_quarter, filters)
+        if entry is None:
+            return {}, UNAVAILABLE, None
+        figure, title = restyle_heat_map(entry['figure'], entry['store'], metric, color_blind_mode)
+        return figure, title, entry['store']
+
+    def animated_map_view(self, filters: FilterSpec, metric: str, color_blind_mode: bool) -> tuple[dict, str]:
+        entry = self._read('animated', filters, metric, color_blind_mode)
+        if entry is None:
+            return {}, UNAVAILABLE
+        return entry['figure'], entry['title']
+
+    def line_view(self, state: str | None, filters: FilterSpec, year_quarter: str | None) -> tuple[dict, str]:
+        entry = self._read('line', state, filters)
+        if entry is None:
+            return {}, UNAVAILABLE
+        figure = entry['figure']
+        annotations = entry['annotations'].get(year_quarter or '')
+        if annotations:
+            figure = {**figure, 'layout': {**figure['layout'], 'annotations': annotations}}
+        return figure, entry['title']
+
+    def chart_views(self, year_quarter: str, state: str | None, filters: FilterSpec, metric: str,
+                    color_blind_mode: bool) -> tuple[tuple[dict, str, dict | None], tuple[dict, str]]:
+        return (self.map_view(year_quarter, filters, metric, color_blind_mode),
+                self.line_view(state, filters, year_quarter))
+
+
+def open_bundle(directory: str | None = STATIC_BUNDLE) -> StaticBundle | None:
+    """Return the configured static bundle, or None to query the data."""
+    return StaticBundle(Path(directory)) if directory else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute every dashboard view into a static bundle.")
+    parser.add_argument('--output', type=Path, default=Path(STATIC_BUNDLE or 'data/snapshot'))
+    parser.add_argument('--quarters', nargs='+', help="Quarters like '2024 Q1' (default: all)")
+    drugs = parser.add_mutually_exclusive_group()
+    drugs.add_argument('--top-drugs', type=int, default=10, help="Include the N drugs with the highest spend")
+    drugs.add_argument('--drugs', nargs='+', help="Include these drug descriptions")
+    drugs.add_argument('--all-drugs', action='store_true', help="Include every drug")
+    parser.add_argument('--states', nargs='+', help="State abbreviations for line charts (default: all)")
+    parser.add_argument('--brands', nargs='+', choices=sorted(BRAND_VALUES), help="Brand filters (default: all, brand, generic)")
+    parser.add_argument('--utilization', nargs='+', choices=sorted(UTILIZATION_VALUES),
+                        help="Utilization filters (default: all, ffsu, mcou)")
+    parser.add_argument('--animated', action='store_true', help="Also bundle the animated map for every metric")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    drug_names = None if args.all_drugs else args.drugs or (top_drugs(args.top_drugs) if args.top_drugs > 0 else [])
+    try:
+        manifest = build_bundle(args.output, args.quarters, drug_names, args.states, args.brands, args.utilization,
+                                args.animated, args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"Wrote {manifest['entries']:,} views for {len(manifest['filters']):,} filter combinations "
+          f"({manifest['bytes'] / 1e6:,.1f} MB) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
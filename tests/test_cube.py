@@ -0,0 +1,85 @@
+"""Check that the map and line queries return the same rows with and without the cube.
+
+Queries run over a small generated dataset, first against the raw rows and then
+after `python -m data_processing.cube` has built the cube next to them.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from benchmarks.generate_data import generate
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# config reads NADAC_* and the data/ paths at import, so each run is a fresh
+# interpreter in the fixture's directory; results are written to parquet for comparison
+QUERIES_SCRIPT = """
+import sys
+from pathlib import Path
+from data_processing.data_processing import year_quarter_list, drug_list, filter_map_data, filter_line_data
+from data_processing.filters import FilterSpec
+from data_processing.reload import current_state
+
+output = Path(sys.argv[1])
+output.mkdir()
+print(current_state().files.cube is not None)
+latest = year_quarter_list()[-1]
+specs = {
+    'all': FilterSpec(),
+    'brand-ffsu': FilterSpec.from_values(None, 'brand', 'ffsu'),
+    'generic-mcou': FilterSpec.from_values(None, 'generic', 'mcou'),
+    # The dropdown's spellings, which the line chart once ignored
+    'ffsu': FilterSpec.from_values(None, 'all', 'Fee-for-Service'),
+    'mcou': FilterSpec.from_values(None, 'all', 'Managed Care'),
+    'drug': FilterSpec.from_values(drug_list('generic')[0], 'generic', 'all'),
+}
+for name, spec in specs.items():
+    filter_map_data(latest, spec).sort('state').collect().write_parquet(output / f"map-{name}.parquet")
+    for state in (None, 'OH'):
+        filter_line_data(state, spec).sort('date').collect().write_parquet(output / f"line-{name}-{state}.parquet")
+"""
+
+
+def _run(directory: Path, env: dict, *args: str) -> str:
+    return subprocess.run([sys.executable, *args], cwd=directory, env=env, capture_output=True, text=True,
+                          check=True).stdout
+
+
+@pytest.fixture(scope='module')
+def results(tmp_path_factory) -> tuple[Path, Path]:
+    """Return the directories of query results without and with the cube."""
+    directory = tmp_path_factory.mktemp('cube')
+    generate(directory / 'data' / 'heat_map.parquet', rows=20_000, n_drugs=50, n_quarters=4)
+    env = {**os.environ, 'PYTHONPATH': str(REPO_ROOT)}
+    for name in ('NADAC_BASE_DATA', 'NADAC_QUERY_ENGINE', 'NADAC_SHARED_IPC_DIR', 'NADAC_STATIC_BUNDLE'):
+        env.pop(name, None)
+
+    assert _run(directory, env, '-c', QUERIES_SCRIPT, 'raw').split() == ['False']
+    _run(directory, env, '-m', 'data_processing.cube')
+    assert _run(directory, env, '-c', QUERIES_SCRIPT, 'cube').split() == ['True']
+    return directory / 'raw', directory / 'cube'
+
+
+def test_cube_matches_raw_rows(results: tuple[Path, Path]) -> None:
+    raw, cube = results
+    names = sorted(path.name for path in raw.iterdir())
+    assert names == sorted(path.name for path in cube.iterdir())
+    assert len(names) == 18
+    for name in names:
+        expected = pl.read_parquet(raw / name)
+        assert expected.height > 0, name
+        assert_frame_equal(pl.read_parquet(cube / name), expected, check_dtypes=False, rel_tol=1e-9)
+
+
+@pytest.mark.parametrize('state', ['None', 'OH'])
+def test_line_utilization_filter_splits_the_rows(results: tuple[Path, Path], state: str) -> None:
+    raw, _ = results
+    units = {name: pl.read_parquet(raw / f"line-{name}-{state}.parquet")['units'].sum()
+             for name in ('all', 'ffsu', 'mcou')}
+    assert 0 < units['ffsu'] < units['all']
+    assert units['ffsu'] + units['mcou'] == pytest.approx(units['all'])
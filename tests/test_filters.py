@@ -0,0 +1,40 @@
+import pytest
+
+from data_processing.filters import FilterSpec, brand_filter, state_abbreviation
+
+
+@pytest.mark.parametrize('brand, expected', [
+    (None, None), ('all', None), ('Brand', True), ('brands', True), (' Generic ', False), ('GENERICS', False),
+])
+def test_brand_spellings(brand, expected) -> None:
+    assert FilterSpec.from_values(None, brand, None).is_brand is expected
+
+
+@pytest.mark.parametrize('utilization, expected', [
+    (None, None), ('All', None), ('Fee-for-Service', True), ('FFSU', True), ('Managed Care', False), ('mcou', False),
+])
+def test_utilization_spellings(utilization, expected) -> None:
+    assert FilterSpec.from_values(None, None, utilization).is_ffsu is expected
+
+
+def test_equal_filters_share_one_cache_key() -> None:
+    spec = FilterSpec.from_values('', 'Brand', 'Fee-for-Service')
+    assert spec == FilterSpec.from_values(None, 'brands', 'ffsu') == FilterSpec(None, True, True)
+    assert hash(spec) == hash(FilterSpec(None, True, True))
+
+
+@pytest.mark.parametrize('brand, utilization', [('branded', None), (None, 'ffs'), (None, 'Medicare')])
+def test_unknown_values_raise(brand, utilization) -> None:
+    with pytest.raises(ValueError):
+        FilterSpec.from_values(None, brand, utilization)
+
+
+def test_brand_filter_names_the_parameter() -> None:
+    with pytest.raises(ValueError, match='^how must be one of'):
+        brand_filter('both', 'how')
+
+
+def test_state_abbreviation() -> None:
+    assert state_abbreviation('Ohio') == 'OH'
+    assert state_abbreviation('OH') == 'OH'
+    assert state_abbreviation(None) is None
@@ -0,0 +1,65 @@
+"""Check that the map and line queries evaluate each rank, per-unit division and window once.
+
+Counts the expensive subexpressions in each query's unoptimized plan, so a
+regression back to nested expressions (which rebuild ranks and divisions inside
+every column that uses them) shows up even when Polars' CSE would hide the cost.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.generate_data import generate
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Substrings of the plan text for one evaluation of each expensive subexpression
+PATTERNS = {
+    'rank': '.rank(',
+    'per-unit division': '/ col("units")',
+    'shift': '.shift(',
+}
+
+# One rank per percentile, one division per per-unit metric, and one shift for
+# the previous quarter index plus one per change metric
+EXPECTED = {
+    'filter_map_data': {'rank': 2, 'per-unit division': 2, 'shift': 3},
+    'filter_map_frames': {'rank': 2, 'per-unit division': 2, 'shift': 3},
+    'filter_line_data': {'rank': 0, 'per-unit division': 2, 'shift': 0},
+}
+
+# config reads NADAC_* and the data/ paths at import, so the plans are built in a
+# fresh interpreter running in the fixture's directory
+PLANS_SCRIPT = """
+import json
+from data_processing.data_processing import year_quarter_list, filter_map_data, filter_map_frames, filter_line_data
+from data_processing.filters import FilterSpec
+
+latest = year_quarter_list()[-1]
+print(json.dumps({
+    'filter_map_data': filter_map_data(latest, FilterSpec()).explain(optimized=False),
+    'filter_map_frames': filter_map_frames(FilterSpec()).explain(optimized=False),
+    'filter_line_data': filter_line_data(None, FilterSpec()).explain(optimized=False),
+}))
+"""
+
+
+@pytest.fixture(scope='module')
+def plans(tmp_path_factory) -> dict[str, str]:
+    """Return the unoptimized plan of each query over a tiny generated dataset."""
+    directory = tmp_path_factory.mktemp('plans')
+    data = directory / 'data' / 'heat_map.parquet'
+    generate(data, rows=5_000, n_drugs=50, n_quarters=4)
+    env = {**os.environ, 'NADAC_BASE_DATA': str(data), 'PYTHONPATH': str(REPO_ROOT)}
+    result = subprocess.run([sys.executable, '-c', PLANS_SCRIPT], cwd=directory, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize('query', EXPECTED)
+@pytest.mark.parametrize('name', PATTERNS)
+def test_subexpression_evaluated_once(plans: dict[str, str], query: str, name: str) -> None:
+    assert plans[query].count(PATTERNS[name]) == EXPECTED[query][name]
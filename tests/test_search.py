@@ -0,0 +1,39 @@
+from data_processing.metadata import Metadata
+from data_processing.search import DrugIndex
+
+METADATA = Metadata(
+    year_quarters=['2024 Q1'],
+    states=['OH'],
+    brand_drugs=['LEVOTHYROXINE 50 MCG TAB', 'SYNTHROID 50 MCG TAB'],
+    generic_drugs=['LEVOTHYROXINE 50 MCG TAB', 'LISINOPRIL 10 MG TAB', 'metformin 500 mg tab'],
+)
+
+
+def test_drug_in_both_lists_matches_brand_and_generic_searches() -> None:
+    index = DrugIndex(METADATA)
+    assert index.search('levo', True).matches == ['LEVOTHYROXINE 50 MCG TAB']
+    assert index.search('levo', False).matches == ['LEVOTHYROXINE 50 MCG TAB']
+    assert index.search(None, False).total == 3
+    assert index.search(None, True).total == 2
+
+
+def test_search_is_case_insensitive_and_ranks_prefix_matches_first() -> None:
+    index = DrugIndex(METADATA)
+    assert index.search('METFORMIN').matches == ['metformin 500 mg tab']
+    assert index.search('50 mcg').matches == ['LEVOTHYROXINE 50 MCG TAB', 'SYNTHROID 50 MCG TAB']
+    assert index.search('syn').matches == ['SYNTHROID 50 MCG TAB']
+    assert index.search('l').matches[:2] == ['LEVOTHYROXINE 50 MCG TAB', 'LISINOPRIL 10 MG TAB']
+
+
+def test_search_pages_results() -> None:
+    index = DrugIndex(METADATA)
+    page = index.search('tab', limit=2, offset=1)
+    assert page.total == 4
+    assert page.matches == ['LISINOPRIL 10 MG TAB', 'metformin 500 mg tab']
+
+
+def test_null_descriptions_are_left_out() -> None:
+    metadata = Metadata(year_quarters=['2024 Q1'], states=[None, 'OH'], brand_drugs=[None, 'SYNTHROID 50 MCG TAB'],
+                        generic_drugs=[None, 'LISINOPRIL 10 MG TAB'])
+    index = DrugIndex(metadata)
+    assert index.search(None).matches == ['LISINOPRIL 10 MG TAB', 'SYNTHROID 50 MCG TAB']
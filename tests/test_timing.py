@@ -0,0 +1,13 @@
+from instrumentation.timing import histograms, stage, timed_callback
+
+
+def test_callbacks_outside_a_request_record_a_total() -> None:
+    @timed_callback('test_background_job')
+    def job():
+        with stage('query'):
+            return 1
+
+    assert job() == 1
+    recorded = {name for callback, name in histograms() if callback == 'test_background_job'}
+    assert recorded == {'query', 'callback', 'total'}
+    assert histograms()[('test_background_job', 'total')].count == 1
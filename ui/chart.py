@@ -3,10 +3,16 @@ from dash import dcc
 from components.section_container import section_container
 from config import PRIMARY_COLOR
 
-def chart(title:str, id: str, chart_title_id: str):
-    return section_container(
-        [
-            dmc.Title(title, order=2, c=PRIMARY_COLOR, id=chart_title_id), # type: ignore
-            dcc.Graph(figure={}, id=id),
-        ]
-    )
\ No newline at end of file
+def chart(title:str, id: str, chart_title_id: str, progress_id: str | None = None):
+    children = [dmc.Title(title, order=2, c=PRIMARY_COLOR, id=chart_title_id)] # type: ignore
+    if progress_id is not None:
+        # Shown while a background callback computes the chart; `<progress_id>-status` reports its stage
+        children.append(dmc.Stack(
+            [
+                dmc.Progress(value=100, striped=True, animated=True, color=PRIMARY_COLOR),
+                dmc.Text(id=f"{progress_id}-status", size="sm", c="dimmed"),
+            ],
+            id=progress_id, gap="xs", display="none",
+        ))
+    children.append(dcc.Graph(figure={}, id=id))
+    return section_container(children)
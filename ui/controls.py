@@ -2,7 +2,7 @@ import dash_mantine_components as dmc
 from components.section_container import section_container
 from config import PRIMARY_COLOR, METRIC_DROPDOWN_LABELS
 # from scratch import state_list, drug_list
-from data_processing.data_processing import year_quarter_list, state_list, drug_list
+from data_processing.data_processing import year_quarter_list, state_list, search_drugs
 
 def map_controls() -> dmc.Container:
     return section_container(
@@ -74,7 +74,8 @@ def map_controls() -> dmc.Container:
                             children=[
                                 dmc.Select(
                                     label="Drug",
-                                    data=drug_list(),
+                                    # First page only; matches load from the server as the user types
+                                    data=search_drugs(None).matches,
                                     searchable=True,
                                     radius="md",
                                     placeholder="Select Drug...",
@@ -90,7 +91,13 @@ def map_controls() -> dmc.Container:
                                     label='Color-vision-friendly mode',
                                     id='color-blind-switch',
                                     size='sm',
-                                )
+                                ),
+                                dmc.Switch(
+                                    label='Animate across quarters',
+                                    id='animate-switch',
+                                    size='sm',
+                                    mt='xs',
+                                ),
                             ]
                         ),
                     ],
@@ -1,22 +1,33 @@
 import dash_mantine_components as dmc
+from dash import dcc
 from components.badges import badge_nadac, badge_sdud, badge_analytics
 from config import HEADER_TITLE
+from data_processing.reload import served_version
 from ui.header import header
 from ui.controls import map_controls, line_chart_controls
 from ui.chart import chart
 from ui.footer import footer
 from ui.help import help_section
 
-layout = dmc.Container(
-    [
-        header(HEADER_TITLE, [badge_nadac(), badge_sdud()]),
-        help_section(),
-        map_controls(),
-        chart(title="", id="map", chart_title_id="map-title"),
-        line_chart_controls(),
-        chart(title='', id="line-chart", chart_title_id="line-chart-title"),
-        footer(HEADER_TITLE, [badge_nadac(), badge_sdud(), badge_analytics()]),
-    ],
-    maw="1000px"
-)
-    
+# Open pages check for a newer data version this often and refresh their dropdowns
+DATA_VERSION_POLL_MS = 60_000
+
+
+def layout() -> dmc.Container:
+    """Build the page for each load, so dropdowns reflect the data version being served."""
+    return dmc.Container(
+        [
+            header(HEADER_TITLE, [badge_nadac(), badge_sdud()]),
+            help_section(),
+            map_controls(),
+            chart(title="", id="map", chart_title_id="map-title"),
+            dcc.Store(id="map-data"),
+            line_chart_controls(),
+            chart(title='', id="line-chart", chart_title_id="line-chart-title", progress_id="line-chart-progress"),
+            dcc.Store(id="chart-request"),
+            footer(HEADER_TITLE, [badge_nadac(), badge_sdud(), badge_analytics()]),
+            dcc.Store(id="data-version", data=served_version()),
+            dcc.Interval(id="data-version-poll", interval=DATA_VERSION_POLL_MS),
+        ],
+        maw="1000px"
+    )
@@ -0,0 +1,160 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import plotly.graph_objects as go
+import polars as pl
+from data_processing.data_processing import filter_map_data, filter_map_frames, filter_line_data, filter_chart_data, top_drugs
+from data_processing.filters import FilterSpec
+from data_processing.result_cache import result_cache
+from data_processing.reload import DataState, register_warmer, serving
+from figures.figures import create_heat_map, create_animated_heat_map, create_line_chart, heat_map_store, restyle_heat_map, animated_heat_map_title
+from assets.states import STATE_ABBREV
+from instrumentation.metrics import record_rows
+from instrumentation.timing import stage
+from config import METRIC_DROPDOWN_LABELS, WARMUP_TOP_DRUGS, WARMUP_WORKERS
+
+logger = logging.getLogger('nadac.warmup')
+
+
+def map_view(year_quarter: str, filters: FilterSpec, metric: str, color_blind_mode: bool) -> tuple[dict, str, dict]:
+    """Return the heat map figure, title and client-side metric store, colored by `metric`."""
+    # Recoloring only swaps z and the colorscale, so every metric shares one cached view
+    return restyled_map(map_base_view(year_quarter, filters), metric, color_blind_mode)
+
+
+@result_cache.memoize
+def map_base_view(year_quarter: str, filters: FilterSpec) -> tuple[dict, dict]:
+    """Return the heat map figure (colored by the first metric) and its metric store for one filter combination."""
+    with stage('query'):
+        filtered_data = filter_map_data(year_quarter=year_quarter, filters=filters, source_rows=True).collect(engine='streaming')
+    record_rows('map', filtered_data['source_rows'].sum())
+    return _map_result(filtered_data, year_quarter)
+
+
+def _map_result(filtered_data: pl.DataFrame, year_quarter: str) -> tuple[dict, dict]:
+    with stage('figure'):
+        fig = create_heat_map(filtered_data, METRIC_DROPDOWN_LABELS[0])
+        store = heat_map_store(filtered_data, year_quarter)
+    return fig.to_dict(), store
+
+
+@result_cache.memoize
+def animated_map_view(filters: FilterSpec, metric: str, color_blind_mode: bool) -> tuple[go.Figure, str]:
+    """Return the heat map animated over every quarter, and its title."""
+    with stage('query'):
+        filtered_data = filter_map_frames(filters=filters, source_rows=True).collect(engine='streaming')
+    record_rows('map', filtered_data['source_rows'].sum())
+    return _animated_map_result(filtered_data, metric, color_blind_mode)
+
+
+def _animated_map_result(filtered_data: pl.DataFrame, metric: str, color_blind_mode: bool) -> tuple[go.Figure, str]:
+    with stage('figure'):
+        fig = create_animated_heat_map(filtered_data, metric, color_blind_mode)
+    quarters = filtered_data['year_quarter']
+    title = animated_heat_map_title(metric, quarters.first(), quarters.last()) if len(quarters) else metric
+    return fig, title
+
+
+@result_cache.memoize
+def line_view(state: str | None, filters: FilterSpec, year_quarter: str | None) -> tuple[go.Figure, str]:
+    """Return the time series figure and title; `state` is an abbreviation."""
+    with stage('query'):
+        filtered_data = filter_line_data(state=state, filters=filters, source_rows=True).collect(engine='streaming')
+    record_rows('line', filtered_data['source_rows'].sum())
+    return _line_result(filtered_data, state, year_quarter)
+
+
+def _line_result(filtered_data: pl.DataFrame, state: str | None, year_quarter: str | None) -> tuple[go.Figure, str]:
+    with stage('figure'):
+        fig = create_line_chart(filtered_data, selected_year_quarter=year_quarter)
+    title = f"NADAC vs SDUD — Unit Price and Payment per Unit (Time Series) for {STATE_ABBREV.get(state, state)}" if state else "NADAC vs SDUD — Unit Price and Payment per Unit (Time Series)"
+    return fig, title
+
+
+def chart_views(year_quarter: str, state: str | None, filters: FilterSpec, metric: str,
+                color_blind_mode: bool) -> tuple[tuple[go.Figure, str, dict], tuple[go.Figure, str]]:
+    """Return the map_view and line_view results for one interaction.
+
+    When neither is cached both come from one scan of the filtered rows; either
+    way they are cached under map_base_view / line_view for later single-chart changes.
+    """
+    with result_cache.scope():
+        map_found, map_result = result_cache.lookup(map_base_view, year_quarter, filters)
+        line_found, line_result = result_cache.lookup(line_view, state, filters, year_quarter)
+        map_result, line_result = compute_chart_views(year_quarter, state, filters,
+                                                      map_result if map_found else None,
+                                                      line_result if line_found else None)
+    return restyled_map(map_result, metric, color_blind_mode), line_result
+
+
+def compute_chart_views(year_quarter: str, state: str | None, filters: FilterSpec, map_result: tuple | None = None,
+                        line_result: tuple | None = None) -> tuple[tuple[dict, dict], tuple[go.Figure, str]]:
+    """Compute and cache the map_base_view and/or line_view result not given, after a cache miss.
+
+    When both are missing they come from one scan of the filtered rows.
+    """
+    map_args = (year_quarter, filters)
+    line_args = (state, filters, year_quarter)
+    with result_cache.scope():
+        if map_result is None and line_result is None:
+            with stage('query'):
+                map_data, line_data = filter_chart_data(year_quarter, state, filters, source_rows=True)
+            record_rows('map', map_data['source_rows'].sum())
+            record_rows('line', line_data['source_rows'].sum())
+            map_result = _map_result(map_data, year_quarter)
+            line_result = _line_result(line_data, state, year_quarter)
+            result_cache.save(map_base_view, map_args, map_result)
+            result_cache.save(line_view, line_args, line_result)
+        elif map_result is None:
+            map_result = map_base_view.__wrapped__(*map_args)
+            result_cache.save(map_base_view, map_args, map_result)
+        elif line_result is None:
+            line_result = line_view.__wrapped__(*line_args)
+            result_cache.save(line_view, line_args, line_result)
+    return map_result, line_result
+
+
+def restyled_map(map_result: tuple[dict, dict], metric: str, color_blind_mode: bool) -> tuple[dict, str, dict]:
+    """Return the map_view result (figure, title, store) for a map_base_view result."""
+    figure, store = map_result
+    figure, title = restyle_heat_map(figure, store, metric, color_blind_mode)
+    return figure, title, store
+
+
+def warm_views(state: DataState) -> None:
+    """Precompute the default view and the top drugs' views for a new data version.
+
+    Runs on a thread pool (Polars releases the GIL while querying) so the result
+    cache is hot before the version is served.
+    """
+    latest = state.metadata.year_quarters[-1]
+    jobs = [
+        (map_base_view, latest, FilterSpec()),
+        (line_view, None, FilterSpec(), latest),
+    ]
+    for drug in top_drugs(WARMUP_TOP_DRUGS) if WARMUP_TOP_DRUGS > 0 else []:
+        jobs.append((map_base_view, latest, FilterSpec(drug=drug)))
+        jobs.append((line_view, None, FilterSpec(drug=drug), latest))
+
+    # Build the default views here first, so any lazy imports behind the first query
+    # and figure finish before several threads race through them
+    failed = sum(not _warm_view(state, *job) for job in jobs[:2])
+    with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix='nadac-warmup') as pool:
+        failed += sum(not ok for ok in pool.map(lambda job: _warm_view(state, *job), jobs[2:]))
+    if failed:
+        raise RuntimeError(f"{failed} of {len(jobs)} warm-up views failed for data version {state.version}")
+
+
+def _warm_view(state: DataState, func, *args) -> bool:
+    # Query the version being warmed, which may not be served yet; one failed view
+    # is logged without abandoning the rest
+    try:
+        with serving(state):
+            result_cache.warm(state.version, func, *args)
+        return True
+    except Exception:
+        logger.exception("Warming %s%s failed", func.__qualname__, args)
+        return False
+
+
+register_warmer(warm_views)